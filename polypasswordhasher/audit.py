@@ -0,0 +1,88 @@
+"""
+Aggregate statistics about a password store for audits.
+
+The report is built in one pass over (username, entries) pairs, so it works
+the same on a loaded PolyPasswordHasher and directly on a password file.
+Record stream password files (write_password_data(records=True) or
+migrate.py) are read one account at a time, so nothing else is kept.   The
+default single pickled dict has to be read whole.
+"""
+import pickle
+
+from .pph import iter_password_file
+
+
+def audit_accounts(accounts):
+    """
+    Returns a report (a dict) about the (username, entries) pairs:
+
+      accounts, entries: how many of each
+      thresholdlessaccounts, thresholdaccounts: accounts with no shares / some
+      sharesperaccount: {number of shares: number of accounts}
+      sharemap: {sharenumber: username} for every share in use
+      duplicateshares: {sharenumber: [usernames]} for shares used more than once
+      maxshare: the largest share number in use (0 if none)
+      gaps: the unused share numbers below maxshare
+      algorithms: {algorithm: number of entries} (None for untagged entries)
+      partialbytes: {number of partial verification bytes: number of entries}
+    """
+    report = {
+        'accounts': 0,
+        'entries': 0,
+        'thresholdlessaccounts': 0,
+        'thresholdaccounts': 0,
+        'sharesperaccount': {},
+        'sharemap': {},
+        'duplicateshares': {},
+        'maxshare': 0,
+        'gaps': [],
+        'algorithms': {},
+        'partialbytes': {},
+    }
+
+    for username, entries in accounts:
+        report['accounts'] += 1
+
+        shares = 0
+        for entry in entries:
+            report['entries'] += 1
+            _count(report['algorithms'], entry.get('algorithm'))
+            # the salted hash is 32 bytes, the rest is partial verification data
+            _count(report['partialbytes'], len(entry['passhash']) - 32)
+
+            sharenumber = entry['sharenumber']
+            if sharenumber == 0:
+                continue
+
+            shares += 1
+            if sharenumber in report['sharemap']:
+                duplicates = report['duplicateshares'].setdefault(
+                    sharenumber, [report['sharemap'][sharenumber]])
+                duplicates.append(username)
+            else:
+                report['sharemap'][sharenumber] = username
+            report['maxshare'] = max(report['maxshare'], sharenumber)
+
+        if shares:
+            report['thresholdaccounts'] += 1
+        else:
+            report['thresholdlessaccounts'] += 1
+        _count(report['sharesperaccount'], shares)
+
+    report['gaps'] = [sharenumber for sharenumber in range(1, report['maxshare'])
+                      if sharenumber not in report['sharemap']]
+    return report
+
+
+def audit_store(pph):
+    """Audits a loaded PolyPasswordHasher."""
+    return audit_accounts(pph.iter_accounts())
+
+
+def audit_password_file(passwordfile, serializer=pickle):
+    """Audits a password file without loading it into a PolyPasswordHasher."""
+    return audit_accounts(iter_password_file(passwordfile, serializer))
+
+
+def _count(counts, key):
+    counts[key] = counts.get(key, 0) + 1
@@ -0,0 +1,339 @@
+"""
+Unlocks a whole cluster of nodes (each with a copy of the same password file)
+with a single set of admin logins.
+
+Each node turns whatever admin logins it is given into shares with
+PolyPasswordHasher.compute_unlock_shares and submits only those shares (never
+passwords) to an UnlockCoordinator.   Once threshold shares are in, the
+coordinator recovers the secret once and hands threshold shares of it back to
+every node that asks.   The nodes then unlock with unlock_with_shares.
+
+Any threshold shares decode to some secret, so the coordinator can't tell
+a mistyped admin password from the right one until there are more.   It
+hands out the secret as soon as threshold shares are in; with more, they
+must agree (a single node's odd shares are dropped).   A node's shares
+replace the ones it sent before, so a password can just be typed again.
+If the shares never agree, reset() starts over.
+
+The nodes do the rest of the checking.   With partial verification, a node
+won't submit a login whose password doesn't match its partial bytes, and
+every node checks the shares it gets back against the partial bytes of its
+password file (and its own submissions) before it unlocks.   Without
+partial verification, a mistyped password among exactly threshold shares
+can't be caught by anyone, so submit a login more than that.
+
+Messages are dicts of JSON types.   Every request and response is
+authenticated with an HMAC-SHA256 keyed by a secret the coordinator shares
+with that node, and each request nonce may only be used once.   Nothing is
+encrypted, so the transport itself must be private (TLS, a unix socket...).
+"""
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import socket
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from .pph import do_bytearray_xor
+from .shamirsecret import ShamirSecret
+
+
+class UnlockCoordinator(object):
+    """
+    Collects shares from authenticated nodes and recovers the secret once.
+    nodekeys maps each node name to the secret key it authenticates with.
+    """
+
+    def __init__(self, threshold, nodekeys):
+        self.threshold = threshold
+        self.nodekeys = dict(nodekeys)
+
+        # node -> {share number -> share data} that node submitted
+        self._submissions = {}
+
+        # the threshold shares handed out once the secret is recovered
+        self._unlockshares = None
+
+        self._usednonces = set()
+        self._lock = threading.Lock()
+
+    def is_unlocked(self):
+        return self._unlockshares is not None
+
+    def reset(self):
+        """Forgets every submission and the recovered secret (say, after
+           shares that never agree or to lock the fleet again)."""
+        with self._lock:
+            self._submissions = {}
+            self._unlockshares = None
+
+    def handle(self, message):
+        """
+        Handles a request from a node and returns the response.   Requests
+        have 'node', 'nonce', 'action' ('submit' or 'collect') and 'mac' keys
+        and submissions also have 'shares'.
+        """
+        node = message.get('node')
+        if node not in self.nodekeys:
+            return {'status': 'error', 'error': 'Unknown node'}
+
+        nodekey = self.nodekeys[node]
+        if not _check_mac(nodekey, message):
+            return {'status': 'error', 'error': 'Bad MAC'}
+
+        with self._lock:
+            nonce = (node, message['nonce'])
+            if nonce in self._usednonces:
+                return {'status': 'error', 'error': 'Reused nonce'}
+            self._usednonces.add(nonce)
+
+            if message['action'] == 'submit':
+                try:
+                    self._submit(node, _decode_shares(message['shares']))
+                except (ValueError, TypeError) as e:
+                    return _sign(nodekey, {'status': 'error', 'error': str(e),
+                                           'nonce': message['nonce']})
+            elif message['action'] != 'collect':
+                return {'status': 'error', 'error': 'Unknown action'}
+
+            response = {'status': 'waiting', 'nonce': message['nonce']}
+            if self._unlockshares is not None:
+                response['status'] = 'unlocked'
+                response['shares'] = _encode_shares(self._unlockshares)
+            return _sign(nodekey, response)
+
+    def _submit(self, node, shares):
+        if self._unlockshares is not None:
+            return
+
+        submission = dict(self._submissions.get(node, {}))
+        submission.update(shares)
+        self._submissions[node] = submission
+
+        # Try everything, then everything but one node's shares (a single
+        # mistyped password).   The odd one out is dropped, but only if the
+        # rest are more than threshold shares, or they could be the typo.
+        nodes = sorted(self._submissions)
+        for leftout in [None] + nodes:
+            minimum = self.threshold if leftout is None else self.threshold + 1
+            shamirsecretobj = self._recover([other for other in nodes if other != leftout], minimum)
+            if shamirsecretobj is not None:
+                break
+        else:
+            if len(self._sharenumbers(nodes)) >= self.threshold:
+                raise ValueError("Shares do not agree.   Submit the right passwords or reset.")
+            return
+
+        if leftout is not None:
+            del self._submissions[leftout]
+
+        self._unlockshares = []
+        for sharenumber in range(1, self.threshold + 1):
+            self._unlockshares.append(shamirsecretobj.compute_share(sharenumber))
+
+    def _sharenumbers(self, nodes):
+        return set(sharenumber for node in nodes for sharenumber in self._submissions[node])
+
+    def _recover(self, nodes, minimum):
+        # Returns a ShamirSecret recovered from (and agreeing with) at least
+        # minimum shares from these nodes, or None.
+        shares = {}
+        for node in nodes:
+            for sharenumber, sharedata in self._submissions[node].items():
+                if shares.setdefault(sharenumber, sharedata) != sharedata:
+                    return None
+
+        if len(shares) < minimum:
+            return None
+
+        shamirsecretobj = ShamirSecret(self.threshold)
+        try:
+            shamirsecretobj.recover_secretdata(sorted(shares.items()))
+        except ValueError:
+            return None
+        return shamirsecretobj
+
+
+class UnlockNode(object):
+    """
+    The node side.   Submits shares for the logins it is given and unlocks
+    pph with the shares the coordinator hands back.
+    """
+
+    def __init__(self, pph, node, nodekey, transport):
+        self.pph = pph
+        self.node = node
+        self.nodekey = nodekey
+        self.transport = transport
+
+        # share number -> share data this node submitted, to check the
+        # coordinator's answer against
+        self._submitted = {}
+
+    def submit(self, logindata):
+        """
+        Submits the shares for these username, password tuples.   Returns True
+        if this node is now unlocked.   With partial verification, a mistyped
+        password raises ValueError here instead of being submitted.
+        """
+        if self.pph.partialbytes and not self.pph.knownsecret:
+            for username, password in logindata:
+                if not self.pph.is_valid_login(username, password):
+                    raise ValueError("Wrong password for '{0}'".format(username))
+
+        shares = self.pph.compute_unlock_shares(logindata)
+        self._submitted.update(shares)
+        return self._request('submit', shares=_encode_shares(shares))
+
+    def poll(self):
+        """Returns True if this node is (now) unlocked."""
+        if self.pph.knownsecret:
+            return True
+        return self._request('collect')
+
+    def _request(self, action, **kwargs):
+        message = {'node': self.node, 'action': action,
+                   'nonce': binascii.hexlify(os.urandom(16)).decode('ascii')}
+        message.update(kwargs)
+
+        response = self.transport.request(_sign(self.nodekey, message))
+
+        if response.get('nonce') != message['nonce'] or not _check_mac(self.nodekey, response):
+            raise ValueError("Unauthenticated response: {0!r}".format(response.get('error')))
+
+        if response['status'] == 'error':
+            raise ValueError(response['error'])
+
+        if response['status'] == 'unlocked' and not self.pph.knownsecret:
+            shares = _decode_shares(response['shares'])
+            self._check_shares(shares)
+            self.pph.unlock_with_shares(shares)
+
+        return self.pph.knownsecret
+
+    def _check_shares(self, shares):
+        # Make sure the coordinator's secret is the one this node's password
+        # file was made with before using it.
+        shamirsecretobj = ShamirSecret(self.pph.threshold)
+        shamirsecretobj.recover_secretdata(shares)
+
+        # Shares from a mistyped password won't match, so those just don't
+        # count.   A secret that matches none of them isn't trusted.
+        checked = 0
+        for sharenumber in self._submitted:
+            if shamirsecretobj.is_valid_share((sharenumber, self._submitted[sharenumber])):
+                checked += 1
+
+        partialbytes = self.pph.partialbytes
+        if partialbytes:
+            for username, entry in self.pph.iter_entries():
+                if entry['sharenumber'] == 0:
+                    continue
+                # the share XOR the stored hash is the salted hash, whose
+                # last bytes are kept at the end
+                sharedata = shamirsecretobj.compute_share(entry['sharenumber'])[1]
+                passhash = entry['passhash']
+                saltedpasswordhash = do_bytearray_xor(passhash[:len(passhash) - partialbytes], sharedata)
+                if saltedpasswordhash[len(saltedpasswordhash) - partialbytes:] != \
+                        bytearray(passhash[len(passhash) - partialbytes:]):
+                    raise ValueError("The coordinator's shares don't decode {0!r}".format(username))
+                checked += 1
+                if checked > self.pph.threshold:
+                    break
+
+        if not checked:
+            raise ValueError("Nothing to check the coordinator's shares with.   Submit a login "
+                             "on this node or use partial verification.")
+
+
+class LocalTransport(object):
+    """Calls an in-process coordinator (through JSON, just like the wire)."""
+
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    def request(self, message):
+        response = self.coordinator.handle(json.loads(json.dumps(message)))
+        return json.loads(json.dumps(response))
+
+
+class SocketTransport(object):
+    """Talks to a coordinator run by serve_coordinator, one line of JSON each way."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def request(self, message):
+        sock = socket.create_connection(self.address)
+        try:
+            sockfile = sock.makefile('rwb')
+            sockfile.write(json.dumps(message).encode('utf8') + b'\n')
+            sockfile.flush()
+            response = sockfile.readline()
+            sockfile.close()
+        finally:
+            sock.close()
+        return json.loads(response.decode('utf8'))
+
+
+def serve_coordinator(coordinator, address):
+    """
+    Serves coordinator on a TCP address in a background thread.   Returns the
+    server (its server_address has the real port if 0 was given).   Call
+    shutdown() on it when done.
+    """
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            line = self.rfile.readline()
+            try:
+                response = coordinator.handle(json.loads(line.decode('utf8')))
+            except (ValueError, KeyError, TypeError, AttributeError):
+                response = {'status': 'error', 'error': 'Malformed request'}
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+
+    server = socketserver.ThreadingTCPServer(address, _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+### Private helpers for the message format...
+
+def _encode_shares(shares):
+    return [[sharenumber, binascii.hexlify(bytes(sharedata)).decode('ascii')]
+            for sharenumber, sharedata in shares]
+
+
+def _decode_shares(encoded):
+    shares = []
+    for sharenumber, sharedata in encoded:
+        shares.append((int(sharenumber), bytearray(binascii.unhexlify(sharedata))))
+    return shares
+
+
+def _compute_mac(key, message):
+    body = dict(message)
+    body.pop('mac', None)
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':')).encode('utf8')
+    return hmac.new(key, canonical, hashlib.sha256).hexdigest()
+
+
+def _sign(key, message):
+    message = dict(message)
+    message['mac'] = _compute_mac(key, message)
+    return message
+
+
+def _check_mac(key, message):
+    if 'mac' not in message:
+        return False
+    return hmac.compare_digest(_compute_mac(key, message), str(message['mac']))
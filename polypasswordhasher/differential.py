@@ -0,0 +1,372 @@
+"""
+Randomized differential testing of the fast code paths against the plain
+Python reference implementations.
+
+Every operation has a reference implementation and a generator of random
+arguments.   Faster implementations (the C fastpolymath module when it can
+be imported, the chunked stream math, the record stream storage format, or
+anything registered later with register_backend) are run on the same
+arguments and must give the same result, or raise the same type of
+exception.   A divergence is shrunk to a small reproducer before it is
+reported.   Shrinking stays within what the operation's generator could
+have produced, so the reproducer is a real input and not, say, an x of 0.
+
+  from polypasswordhasher import differential
+  for divergence in differential.run(iterations=1000, seed=1):
+      print(divergence)
+"""
+import os
+import pickle
+import random
+import shutil
+import tempfile
+
+from . import shamirsecret
+
+
+# operation -> reference implementation
+REFERENCES = {}
+
+# operation -> function(rng) returning a tuple of random arguments
+GENERATORS = {}
+
+# operation -> function(*args) returning whether the generator could have
+# made those arguments
+VALIDATORS = {}
+
+# operation -> {backend name -> implementation}
+BACKENDS = {}
+
+
+def register_backend(operation, name, function):
+    """Adds a fast implementation of operation to check against its reference."""
+    if operation not in REFERENCES:
+        raise ValueError("Unknown operation: {0!r}".format(operation))
+    BACKENDS[operation][name] = function
+
+
+def _register_operation(operation, reference, generator, validator):
+    REFERENCES[operation] = reference
+    GENERATORS[operation] = generator
+    VALIDATORS[operation] = validator
+    BACKENDS[operation] = {}
+
+
+class Divergence(object):
+    """A (minimized) set of arguments on which a backend and the reference differ."""
+
+    def __init__(self, operation, backend, args, expected, got):
+        self.operation = operation
+        self.backend = backend
+        self.args = args
+        self.expected = expected
+        self.got = got
+
+    def __repr__(self):
+        return "{0} backend {1!r} differs on {0}{2!r}: expected {3!r}, got {4!r}".format(
+            self.operation, self.backend, tuple(self.args), self.expected, self.got)
+
+    __str__ = __repr__
+
+
+def run(iterations=100, seed=None, operations=None):
+    """
+    Checks every backend of the given operations (default all) against the
+    reference on iterations random inputs each.   Returns the list of
+    minimized Divergences (at most one per backend).
+    """
+    rng = random.Random(seed)
+    divergences = []
+
+    for operation in sorted(operations or REFERENCES):
+        diverged = set()
+        for _ in range(iterations):
+            args = GENERATORS[operation](rng)
+            for name in sorted(BACKENDS[operation]):
+                if name in diverged:
+                    continue
+                if _differs(operation, name, args):
+                    diverged.add(name)
+                    divergences.append(minimize(operation, name, args))
+
+    return divergences
+
+
+def minimize(operation, backend, args):
+    """
+    Greedily shrinks args (keeping them valid for the operation) while the
+    backend still differs from the reference and returns the resulting
+    Divergence.
+    """
+    args = list(args)
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        for candidate in _shrink_candidates(args):
+            if VALIDATORS[operation](*candidate) and _differs(operation, backend, candidate):
+                args = candidate
+                shrunk = True
+                break
+
+    expected = _outcome(REFERENCES[operation], args)
+    got = _outcome(BACKENDS[operation][backend], args)
+    return Divergence(operation, backend, args, expected, got)
+
+
+### Private helpers...
+
+def _outcome(function, args):
+    # results are normalized so that, say, a bytearray and bytes can agree.
+    # Exceptions only need to be of the same type.
+    try:
+        result = function(*_copy(args))
+    except Exception as e:
+        return ('raised', type(e).__name__)
+    return ('returned', _normalize(result))
+
+
+def _differs(operation, backend, args):
+    return _outcome(REFERENCES[operation], args) != _outcome(BACKENDS[operation][backend], args)
+
+
+def _normalize(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, _normalize(value[key])) for key in value)
+    return value
+
+
+def _copy(value):
+    # so a backend that mutates its arguments can't affect the next one
+    if isinstance(value, bytearray):
+        return bytearray(value)
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, dict):
+        return dict((key, _copy(value[key])) for key in value)
+    return value
+
+
+def _shrink_candidates(args):
+    """Yields copies of args that are a little simpler."""
+
+    # drop the same position from every sequence argument of the same length
+    # (like xs and fxs), so they stay consistent
+    sequences = (list, bytes, bytearray)
+    lengths = set(len(arg) for arg in args if isinstance(arg, sequences))
+    for length in sorted(lengths):
+        for pos in range(length):
+            yield [arg[:pos] + arg[pos + 1:] if isinstance(arg, sequences) and len(arg) == length else arg
+                   for arg in args]
+
+    for index, arg in enumerate(args):
+        for simpler in _shrink_value(arg):
+            yield args[:index] + [simpler] + args[index + 1:]
+
+
+def _shrink_value(value):
+    if isinstance(value, bool):
+        return
+    if isinstance(value, int):
+        for simpler in [0, 1, value // 2, value - 1]:
+            if 0 <= simpler < value:
+                yield simpler
+    elif isinstance(value, (bytes, bytearray)):
+        for pos in range(len(value)):
+            yield value[:pos] + value[pos + 1:]
+        for pos in range(len(value)):
+            if value[pos:pos + 1] != b'\x00':
+                yield value[:pos] + type(value)(b'\x00') + value[pos + 1:]
+    elif isinstance(value, list):
+        for pos in range(len(value)):
+            yield value[:pos] + value[pos + 1:]
+        for pos in range(len(value)):
+            for simpler in _shrink_value(value[pos]):
+                yield value[:pos] + [simpler] + value[pos + 1:]
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            smaller = dict(value)
+            del smaller[key]
+            yield smaller
+
+
+def _random_bytes(rng, size):
+    return bytearray(rng.randrange(256) for _ in range(size))
+
+
+### The operations and their reference implementations...
+
+def _f_reference(x, coefs_bytes):
+    # the pure Python path, even if SPEEDUP gets turned on
+    speedup = shamirsecret.SPEEDUP
+    shamirsecret.SPEEDUP = False
+    try:
+        return shamirsecret._f(x, coefs_bytes)
+    finally:
+        shamirsecret.SPEEDUP = speedup
+
+
+def _f_generator(rng):
+    return rng.randrange(1, 256), _random_bytes(rng, rng.randrange(1, 12))
+
+
+def _f_valid(x, coefs_bytes):
+    return 1 <= x <= 255 and len(coefs_bytes) >= 1
+
+
+def _f_chunk_backend(x, coefs_bytes):
+    if x == 0:
+        raise ValueError('invalid share index value, cannot be 0')
+    coefficients = [bytes(bytearray([coefficient])) for coefficient in bytearray(coefs_bytes)]
+    return bytearray(shamirsecret._f_chunk(shamirsecret._gf256_multable(x), coefficients))[0]
+
+
+def _full_lagrange_reference(xs, fxs):
+    speedup = shamirsecret.SPEEDUP
+    shamirsecret.SPEEDUP = False
+    try:
+        return shamirsecret._full_lagrange(xs, fxs)
+    finally:
+        shamirsecret.SPEEDUP = speedup
+
+
+def _full_lagrange_generator(rng):
+    count = rng.randrange(1, 10)
+    xs = rng.sample(range(1, 256), count)
+    fxs = [rng.randrange(256) for _ in range(count)]
+    return xs, fxs
+
+
+def _full_lagrange_valid(xs, fxs):
+    return (len(xs) == len(fxs) >= 1 and len(set(xs)) == len(xs) and
+            all(1 <= x <= 255 for x in xs) and all(0 <= fx <= 255 for fx in fxs))
+
+
+def _secret_from_shares_reference(xs, fxs):
+    # the constant term of the polynomial through the points
+    return _full_lagrange_reference(xs, fxs)[0]
+
+
+def _secret_from_shares_stream(xs, fxs):
+    if len(xs) != len(fxs) or not xs or len(set(xs)) != len(xs):
+        raise AssertionError("bad points")
+    tables = [shamirsecret._gf256_multable(weight)
+              for weight in shamirsecret._lagrange_weights(xs, 0)]
+    chunks = [bytes(bytearray([fx])) for fx in fxs]
+    return bytearray(shamirsecret._weighted_sum(tables, chunks))[0]
+
+
+def _xor_reference(a, b):
+    from .pph import do_bytearray_xor
+    return do_bytearray_xor(a, b)
+
+
+def _xor_generator(rng):
+    size = rng.randrange(0, 64)
+    return _random_bytes(rng, size), _random_bytes(rng, size)
+
+
+def _xor_valid(a, b):
+    return len(a) == len(b)
+
+
+def _xor_bytes_backend(a, b):
+    if len(a) != len(b):
+        raise AssertionError("different lengths")
+    return shamirsecret._xor_bytes(bytes(a), bytes(b))
+
+
+def _storage_generator(rng):
+    accountdict = {}
+    nextshare = 1
+    for number in range(rng.randrange(1, 8)):
+        entries = []
+        shares = rng.randrange(0, 4)
+        for sharenumber in (range(nextshare, nextshare + shares) if shares else [0]):
+            entries.append({'sharenumber': sharenumber,
+                            'salt': bytes(_random_bytes(rng, 16)),
+                            'algorithm': 'sha256',
+                            'params': {},
+                            'passhash': bytes(_random_bytes(rng, 32 + rng.randrange(3)))})
+        nextshare += shares
+        accountdict['user{0}'.format(number)] = entries
+    return (accountdict,)
+
+
+def _storage_valid(accountdict):
+    if not accountdict:
+        return False
+    sharenumbers = []
+    for entries in accountdict.values():
+        if not entries:
+            return False
+        for entry in entries:
+            if sorted(entry) != ['algorithm', 'params', 'passhash', 'salt', 'sharenumber']:
+                return False
+            if len(entry['salt']) != 16 or not 32 <= len(entry['passhash']) <= 34:
+                return False
+            if entry['sharenumber']:
+                sharenumbers.append(entry['sharenumber'])
+    return len(set(sharenumbers)) == len(sharenumbers)
+
+
+def _load(passwordfile):
+    from .pph import PolyPasswordHasher
+    pph = PolyPasswordHasher(1, passwordfile)
+    return pph.accountdict, pph.nextavailableshare
+
+
+def _in_tempdir(function):
+    def wrapper(accountdict):
+        tempdir = tempfile.mkdtemp()
+        try:
+            return function(accountdict, os.path.join(tempdir, 'securepasswords'))
+        finally:
+            shutil.rmtree(tempdir)
+    return wrapper
+
+
+@_in_tempdir
+def _storage_reference(accountdict, passwordfile):
+    # the original format, a single pickled dict
+    with open(passwordfile, 'wb') as outfile:
+        pickle.dump(accountdict, outfile)
+    return _load(passwordfile)
+
+
+@_in_tempdir
+def _storage_records(accountdict, passwordfile):
+    from .migrate import append_record
+    with open(passwordfile, 'wb') as outfile:
+        for username in sorted(accountdict):
+            append_record(outfile, username, accountdict[username])
+    return _load(passwordfile)
+
+
+_register_operation('f', _f_reference, _f_generator, _f_valid)
+_register_operation('full_lagrange', _full_lagrange_reference, _full_lagrange_generator,
+                    _full_lagrange_valid)
+_register_operation('secret_from_shares', _secret_from_shares_reference, _full_lagrange_generator,
+                    _full_lagrange_valid)
+_register_operation('xor', _xor_reference, _xor_generator, _xor_valid)
+_register_operation('storage', _storage_reference, _storage_generator, _storage_valid)
+
+register_backend('f', 'stream', _f_chunk_backend)
+register_backend('secret_from_shares', 'stream', _secret_from_shares_stream)
+register_backend('xor', 'stream', _xor_bytes_backend)
+register_backend('storage', 'records', _storage_records)
+
+if shamirsecret.fastpolymath is not None:
+    # called the same way shamirsecret calls it when SPEEDUP is on
+    def _f_fastpolymath(x, coefs_bytes):
+        if x == 0:
+            raise ValueError('invalid share index value, cannot be 0')
+        return shamirsecret.fastpolymath.f(chr(x), str(coefs_bytes))
+
+    register_backend('f', 'fastpolymath', _f_fastpolymath)
+    register_backend('full_lagrange', 'fastpolymath', shamirsecret.fastpolymath.full_lagrange)
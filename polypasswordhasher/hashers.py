@@ -0,0 +1,37 @@
+"""
+The salted password hashing algorithms that entries can be tagged with.
+
+Each entry written by PolyPasswordHasher records the name of its algorithm
+and the parameters it was used with, so the preferred algorithm can change
+without invalidating existing entries.   Every algorithm must produce 32
+bytes since the result is XORed with a share (or AES encrypted with the
+thresholdless key).
+"""
+import hashlib
+
+
+def _sha256(salt, password):
+    return hashlib.sha256(salt + password).digest()
+
+
+def _pbkdf2_sha256(salt, password, iterations=100000):
+    return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+
+
+# keyed by the name stored in each entry's 'algorithm' field
+ALGORITHMS = {
+    'sha256': _sha256,
+    'pbkdf2_sha256': _pbkdf2_sha256,
+}
+
+
+def salted_hash(algorithm, params, salt, password):
+    """
+    Hashes the salted password with the named algorithm and its parameters
+    (a dict of keyword arguments).   Raises a ValueError for unknown
+    algorithms.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unknown hash algorithm: {0!r}".format(algorithm))
+
+    return ALGORITHMS[algorithm](salt, password, **params)
@@ -0,0 +1,241 @@
+"""
+Moves an existing user base into a PolyPasswordHasher password file without
+holding it all in memory.
+
+The credentials are read lazily, hashed a chunk at a time on a process pool
+and written out as a stream of (username, entries) records that
+PolyPasswordHasher (and pph.iter_password_file) can load.   If a migration is
+interrupted, calling migrate_accounts again with the same source and an
+unlocked PolyPasswordHasher for the same secret picks up where it stopped.
+"""
+import csv
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+
+from .hashers import salted_hash
+from .pph import iter_password_file
+from .shamirsecret import PY3
+
+
+def read_credentials(sourcefile):
+    """
+    Yields (username, password, shares) tuples from a credential dump.   Files
+    ending in .jsonl or .json hold one JSON object per line with 'username',
+    'password' and 'shares' keys.   Anything else is read as CSV with those
+    three columns (an optional header row is skipped).
+    """
+    if sourcefile.endswith('.jsonl') or sourcefile.endswith('.json'):
+        with io.open(sourcefile, 'r', encoding='utf8') as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield record['username'], record['password'], int(record['shares'])
+        return
+
+    if PY3:
+        infile = io.open(sourcefile, 'r', encoding='utf8', newline='')
+    else:
+        infile = open(sourcefile, 'rb')
+
+    with infile:
+        for row in csv.reader(infile):
+            if not row:
+                continue
+            if row == ['username', 'password', 'shares']:
+                continue
+            if len(row) != 3:
+                raise ValueError("Invalid credential row: {0!r}".format(row))
+            yield row[0], row[1], int(row[2])
+
+
+def migrate_accounts(pph, credentials, passwordfile, chunksize=1000, pool=None, processes=None):
+    """
+    Adds every (username, password, shares) from the credentials iterable to
+    passwordfile, which must be new or a record stream written by an earlier
+    (possibly interrupted) call.   pph must be unlocked.   Its share counter
+    is advanced but the new entries are not kept in pph.accountdict, so
+    memory use is bounded by chunksize (plus a set of the usernames seen).
+    A username that appears twice in credentials raises a ValueError.
+
+    To resume, run repair_password_file on the partial file, load and unlock
+    it, then call this again with the same credentials.   Usernames already
+    in the file are skipped.   If pph wasn't loaded from passwordfile (so
+    new entries would be made with some other secret), a ValueError is
+    raised before anything is written.
+
+    Share numbers are handed out as the credentials stream by, so whether
+    there are enough of them is only known at the end.   If the file holds
+    no more than threshold shares, a ValueError is raised after writing it.
+    The file can't be unlocked like that, but it can be resumed with more
+    accounts that have shares.
+
+    The salted hashing is done on pool (a multiprocessing.Pool).   If none is
+    given, one with the given number of processes is created for this call.
+    Returns the number of accounts in passwordfile.
+    """
+    if not pph.knownsecret:
+        raise ValueError("Password File is not unlocked!")
+
+    chunksize = int(chunksize)
+    if chunksize <= 0:
+        raise ValueError("Invalid chunksize: {0}".format(chunksize))
+
+    doneusernames, maxshare, goodlength = _scan_records(passwordfile, pph.serializer)
+    donecount = len(doneusernames)
+    if doneusernames:
+        _check_same_store(pph, passwordfile, doneusernames)
+
+    # never hand out a share that is already in the file...
+    pph.nextavailableshare = max(pph.nextavailableshare, maxshare + 1)
+
+    # ...and skip the credentials that made it there last time.
+    credentials = _new_credentials(credentials, doneusernames)
+
+    ownpool = pool is None
+    if ownpool:
+        pool = multiprocessing.Pool(processes)
+
+    if donecount or goodlength:
+        outfile = open(passwordfile, 'r+b')
+        outfile.truncate(goodlength)
+        outfile.seek(goodlength)
+    else:
+        outfile = open(passwordfile, 'wb')
+
+    try:
+        while True:
+            chunk = list(itertools.islice(credentials, chunksize))
+            if not chunk:
+                break
+
+            # get every salt for this chunk and hash them all at once
+            tasks = []
+            accounts = []
+            for username, password, shares in chunk:
+                shares = int(shares)
+                if PY3:
+                    password = bytes(password, encoding='utf8')
+                salts = [os.urandom(pph.saltsize) for _ in range(max(shares, 1))]
+                for salt in salts:
+                    tasks.append((pph.algorithm, pph.algorithmparams, salt, password))
+                accounts.append((username, shares, salts))
+
+            saltedpasswordhashes = pool.map(_salted_hash, tasks)
+
+            # Now use up the shares in order.   This has to happen here since
+            # share numbers are handed out sequentially.
+            pos = 0
+            for username, shares, salts in accounts:
+                pph._check_new_account(username, shares)
+                entries = pph._build_entries(shares, salts,
+                                             saltedpasswordhashes[pos:pos + len(salts)])
+                pos += len(salts)
+                append_record(outfile, username, entries, pph.serializer)
+                donecount += 1
+
+            # make sure a resumed run sees every record of this chunk
+            outfile.flush()
+            os.fsync(outfile.fileno())
+    finally:
+        outfile.close()
+        if ownpool:
+            pool.close()
+            pool.join()
+
+    if pph.threshold >= pph.nextavailableshare:
+        raise ValueError("Wrote undecodable password file.   Must have more shares.")
+
+    return donecount
+
+
+def append_record(outfile, username, entries, serializer=pickle):
+    """
+    Writes one account to an open password file in the record stream format
+    that pph.iter_password_file reads.
+    """
+    serializer.dump((username, entries), outfile)
+
+
+def repair_password_file(passwordfile, serializer=pickle):
+    """
+    Cuts a torn record (from a crash mid-write) off the end of a partially
+    migrated password file so that it can be loaded again.   Returns the
+    number of complete records.
+    """
+    usernames, _, goodlength = _scan_records(passwordfile, serializer)
+    if os.path.getsize(passwordfile) != goodlength:
+        with open(passwordfile, 'r+b') as outfile:
+            outfile.truncate(goodlength)
+    return len(usernames)
+
+
+def _scan_records(passwordfile, serializer=pickle):
+    """
+    Returns the set of usernames in the complete records of a partially
+    migrated file, the largest share number they use and the length of the
+    file up to the end of the last complete record.
+    """
+    usernames = set()
+    maxshare = 0
+    goodlength = 0
+
+    if not os.path.exists(passwordfile):
+        return usernames, maxshare, goodlength
+
+    with open(passwordfile, 'rb') as infile:
+        while True:
+            try:
+                record = serializer.load(infile)
+            except (EOFError, pickle.UnpicklingError):
+                # the end of the file or a torn write.   Either way, stop here.
+                break
+
+            if not isinstance(record, tuple) or len(record) != 2:
+                raise ValueError("Not a migrated password file: {0}".format(passwordfile))
+
+            if record[0] in usernames:
+                raise ValueError("Duplicate username {0!r} in {1}".format(record[0], passwordfile))
+            usernames.add(record[0])
+            for entry in record[1]:
+                maxshare = max(maxshare, entry['sharenumber'])
+            goodlength = infile.tell()
+
+    return usernames, maxshare, goodlength
+
+
+def _check_same_store(pph, passwordfile, doneusernames):
+    # New entries are made with pph's secret, so pph has to be the store the
+    # file was loaded into, not a new one
+    if not doneusernames.issubset(pph.accountdict):
+        raise ValueError("{0} has accounts that aren't in this PolyPasswordHasher.   "
+                         "Load and unlock it to resume.".format(passwordfile))
+
+    username, entries = next(iter_password_file(passwordfile, pph.serializer))
+    if pph.accountdict[username] != entries:
+        raise ValueError("{0} doesn't match this PolyPasswordHasher".format(passwordfile))
+    # this checks the partial bytes against the secret, if there are any
+    for entry in entries:
+        pph._check_reloaded_entry(username, entry)
+
+
+def _new_credentials(credentials, doneusernames):
+    # pph.accountdict isn't filled during a migration, so duplicates have to
+    # be caught here
+    seen = set()
+    for credential in credentials:
+        username = credential[0]
+        if username in seen:
+            raise ValueError("Duplicate username in credentials: {0!r}".format(username))
+        seen.add(username)
+        if username not in doneusernames:
+            yield credential
+
+
+# This runs in the pool's worker processes, so it must be at module level.
+def _salted_hash(task):
+    return salted_hash(*task)
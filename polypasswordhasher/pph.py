@@ -1,10 +1,17 @@
+import binascii
+import json
 import os
 import pickle
 import hashlib
+import tempfile
+import threading
+
+from concurrent.futures import Future
 
 # For thresholdless password support...
 from Crypto.Cipher import AES
 
+from .hashers import salted_hash
 from .shamirsecret import PY3
 try:
     from .fastshamirsecret import ShamirSecret
@@ -17,8 +24,11 @@ class PolyPasswordHasher(object):
     This is a PolyHash object that has special routines for passwords
     """
     # this is keyed by user name.  Each value is a list of dicts (really a
-    # struct) where each dict contains the salt, sharenumber, and
-    # passhash (saltedhash XOR shamirsecretshare).
+    # struct) where each dict contains the salt, sharenumber,
+    # passhash (saltedhash XOR shamirsecretshare) and the algorithm and
+    # params the salted hash was computed with.   An account is changed by
+    # replacing its list, never in place, so a shallow copy of this is a
+    # consistent snapshot.
     accountdict = None
 
     # This contains the shamirsecret object for this data store
@@ -31,9 +41,30 @@ class PolyPasswordHasher(object):
     # length of the salt in bytes
     saltsize = 16
 
-    # hashing algorithm
+    # hashing algorithm for entries without an algorithm tag (those written
+    # before entries were tagged)
     hasher = hashlib.sha256
 
+    # hashing algorithm (a name from hashers.ALGORITHMS) and its parameters
+    # used for new entries
+    algorithm = 'sha256'
+    algorithmparams = {}
+
+    # if set, entries using another algorithm are rehashed with the one above
+    # after a successful login (while unlocked)
+    upgradeonlogin = False
+
+    # set (say, by a registry that has unloaded this object) to refuse changes
+    readonly = False
+
+    # set this to a verifierindex.VerifierIndex to check unlocked logins
+    # against the expected salted hashes instead of recomputing shares
+    verifierindex = None
+
+    # set this to a resultcache.ResultCache to remember successful logins
+    # for a while (only used while unlocked)
+    resultcache = None
+
     # serialization object supporting dump/load methods
     serializer = pickle
 
@@ -44,17 +75,34 @@ class PolyPasswordHasher(object):
     # algorithm
     thresholdlesskey = None
 
+    # (key, cipher) for the key above.   ECB cipher objects keep no state
+    # between blocks, so one can be reused rather than redoing the key
+    # schedule for every entry.
+    _thresholdlesscipher = None
+
     # number of used shares.   While I could duplicate shares for normal users,
     # I don't do so in this implementation.   This duplication would allow
     # co-analysis of password hashes
     nextavailableshare = 1
 
+    # Every change to accountdict gets the next sequence number, which is
+    # kept per username in accountsequence.   This lets export_delta send a
+    # standby only what changed.   Numbering starts over for each object, so
+    # deltas also carry the random epoch of the object that numbered them.
+    changesequence = 0
+    accountsequence = None
+    epoch = None
+
     def __init__(self, threshold, passwordfile=None, partialbytes=0):
 
         self.threshold = threshold
 
         self.accountdict = {}
 
+        self.changesequence = 0
+        self.accountsequence = {}
+        self.epoch = binascii.hexlify(os.urandom(8)).decode('ascii')
+
         self.partialbytes = partialbytes
 
         # creating a new password file
@@ -77,9 +125,7 @@ class PolyPasswordHasher(object):
         self.thresholdlesskey = None
 
         # just want to deserialize this data.  Should do better validation
-        self.accountdict = self.serializer.load(open(passwordfile, 'rb'))
-
-        assert isinstance(self.accountdict, dict)
+        self.accountdict = dict(iter_password_file(passwordfile, self.serializer))
 
         # compute which share number is the largest used...
         for username in self.accountdict:
@@ -100,15 +146,32 @@ class PolyPasswordHasher(object):
         if PY3:
             password = bytes(password, encoding='utf8')
 
+        self._check_new_account(username, shares)
+
+        # a thresholdless account still gets one entry (with sharenumber 0)
+        salts = [os.urandom(self.saltsize) for _ in range(max(shares, 1))]
+        saltedpasswordhashes = [salted_hash(self.algorithm, self.algorithmparams, salt, password)
+                                for salt in salts]
+
+        self.accountdict[username] = self._build_entries(shares, salts, saltedpasswordhashes)
+        self._note_change(username)
+
+        if shares == 0:
+            return self.accountdict[username][0]
+        return self.accountdict[username]
+
+    def _check_new_account(self, username, shares):
+        """
+        Raises a ValueError if an account with this many shares can't be added.
+        """
+        self._check_writable()
+
         if not self.knownsecret:
             raise ValueError("Password File is not unlocked!")
 
         if username in self.accountdict:
             raise ValueError("Username exists already!")
 
-        # Were I to add support for changing passwords, etc. this code would be
-        # moved to an internal helper.
-
         if shares > 255 or shares < 0:
             raise ValueError("Invalid number of shares: {0}".format(shares))
 
@@ -117,47 +180,129 @@ class PolyPasswordHasher(object):
         if shares + self.nextavailableshare > 255:
             raise ValueError("Would exceed maximum number of shares: {}".format(shares))
 
-        # for each share, we will add the appropriate dictionary.
-        self.accountdict[username] = []
-
+    def _build_entries(self, shares, salts, saltedpasswordhashes):
+        """
+        Builds the entries for a new account from already computed salted
+        hashes (one per salt) and uses up the next shares.   The hashing is
+        kept out of here so that it can be done elsewhere (see migrate.py).
+        """
         if shares == 0:
-            thisentry = {}
-            thisentry['sharenumber'] = 0
-            # get a random salt, salt the password and store the salted hash
-            thisentry['salt'] = os.urandom(self.saltsize)
-            saltedpasswordhash = self.hasher(thisentry['salt'] + password).digest()
+            # don't increment the share count!
+            return [self._make_entry(0, salts[0], saltedpasswordhashes[0])]
+
+        entries = []
+        for pos in range(shares):
+            entries.append(self._make_entry(self.nextavailableshare + pos, salts[pos],
+                                            saltedpasswordhashes[pos]))
+
+        # increment the share counter.
+        self.nextavailableshare += shares
+        return entries
+
+    def _make_entry(self, sharenumber, salt, saltedpasswordhash):
+        """
+        Makes the entry for this share (0 for thresholdless) from a salted
+        hash computed with the current algorithm.
+        """
+        thisentry = {}
+        thisentry['sharenumber'] = sharenumber
+        thisentry['salt'] = salt
+        thisentry['algorithm'] = self.algorithm
+        thisentry['params'] = dict(self.algorithmparams)
+
+        if sharenumber == 0:
             # Encrypt the salted secure hash.   The salt should make all entries
             # unique when encrypted.
-            thisentry['passhash'] = AES.new(self.thresholdlesskey).encrypt(saltedpasswordhash)
+            thisentry['passhash'] = self._cipher().encrypt(saltedpasswordhash)
             # technically, I'm supposed to remove some of the prefix here, but why
             # bother?
-
-            # append the partial verification data...
-            thisentry['passhash'] += saltedpasswordhash[len(saltedpasswordhash) - self.partialbytes:]
-            thisentry['passhash'] = bytes(thisentry['passhash'])
-
-            self.accountdict[username].append(thisentry)
-            # and exit (don't increment the share count!)
-            return thisentry
-
-        for sharenumber in range(self.nextavailableshare, self.nextavailableshare + shares):
-            thisentry = {}
-            thisentry['sharenumber'] = sharenumber
+        else:
             # take the bytearray part of this
             shamirsecretdata = self.shamirsecretobj.compute_share(sharenumber)[1]
-            thisentry['salt'] = os.urandom(self.saltsize)
-            saltedpasswordhash = self.hasher(thisentry['salt'] + password).digest()
             # XOR the two and keep this.   This effectively hides the hash unless
             # threshold hashes can be simultaneously decoded
             thisentry['passhash'] = do_bytearray_xor(saltedpasswordhash, shamirsecretdata)
-            # append the partial verification data...
-            thisentry['passhash'] += saltedpasswordhash[len(saltedpasswordhash) - self.partialbytes:]
-            thisentry['passhash'] = bytes(thisentry['passhash'])
-            self.accountdict[username].append(thisentry)
 
-        # increment the share counter.
-        self.nextavailableshare += shares
-        return self.accountdict[username]
+        # append the partial verification data...
+        thisentry['passhash'] += saltedpasswordhash[len(saltedpasswordhash) - self.partialbytes:]
+        thisentry['passhash'] = bytes(thisentry['passhash'])
+        return thisentry
+
+    def _cipher(self):
+        if self._thresholdlesscipher is None or self._thresholdlesscipher[0] != self.thresholdlesskey:
+            self._thresholdlesscipher = (self.thresholdlesskey, AES.new(self.thresholdlesskey))
+        return self._thresholdlesscipher[1]
+
+    def _hash_for_entry(self, entry, password):
+        """
+        Computes the salted hash of password with the entry's own algorithm.
+        """
+        if 'algorithm' not in entry:
+            return self.hasher(entry['salt'] + password).digest()
+
+        return salted_hash(entry['algorithm'], entry['params'], entry['salt'], password)
+
+    def _upgrade_account(self, username, entries, password):
+        """
+        Rehashes the password (already verified against entries) for every
+        entry that doesn't use the current algorithm.   The entries keep their
+        share numbers.   Returns the list username now has, or None if the
+        account was changed by something else since it was checked.
+        """
+        newentries = []
+        changed = False
+        for entry in entries:
+            if entry.get('algorithm') == self.algorithm and entry['params'] == self.algorithmparams:
+                newentries.append(entry)
+                continue
+
+            changed = True
+
+            salt = os.urandom(self.saltsize)
+            saltedpasswordhash = salted_hash(self.algorithm, self.algorithmparams, salt, password)
+            newentries.append(self._make_entry(entry['sharenumber'], salt, saltedpasswordhash))
+
+        if not changed or self.readonly:
+            return entries
+
+        # don't undo a change (say, a new password) made after the check
+        if self.accountdict.get(username) is not entries:
+            return None
+
+        # swap in the whole list so readers never see a half upgraded account
+        self.accountdict[username] = newentries
+        self._note_change(username)
+        return newentries
+
+    def _check_writable(self):
+        if self.readonly:
+            raise ValueError("Password File is read only!")
+
+    def _note_change(self, username):
+        self.changesequence += 1
+        self.accountsequence[username] = self.changesequence
+        self._forget_account(username)
+
+    def _forget_account(self, username):
+        # drops anything remembered about an account that changed
+        if self.verifierindex is not None:
+            self.verifierindex.invalidate(username)
+        if self.resultcache is not None:
+            self.resultcache.invalidate(username)
+
+    def iter_accounts(self):
+        """
+        Yields (username, entries) for every account.   Accounts added while
+        this runs may or may not be included.
+        """
+        for username in list(self.accountdict):
+            entries = self.accountdict.get(username)
+            if entries is not None:
+                yield username, entries
+
+    def iter_entries(self):
+        """Yields (username, entry) for every entry of every account."""
+        return iter_entries(self.iter_accounts())
 
     def is_valid_login(self, username, password):
         if PY3:
@@ -169,13 +314,36 @@ class PolyPasswordHasher(object):
         if username not in self.accountdict:
             raise ValueError("Unknown user {0!r}".format(username))
 
+        entries = self.accountdict[username]
+
+        if self.knownsecret and self.resultcache is not None:
+            if self.resultcache.get(self.thresholdlesskey, username, password, entries):
+                return True
+
+        if self.knownsecret and self.verifierindex is not None:
+            valid = self._check_verifier_index(username, entries, password)
+        else:
+            valid = self._check_entries(entries, password)
+
+        if valid and self.knownsecret:
+            if self.upgradeonlogin:
+                entries = self._upgrade_account(username, entries, password)
+            # only for the list the password was checked against (or that
+            # replaced it in the upgrade), if the account still has it
+            if self.resultcache is not None and entries is not None and \
+                    self.accountdict.get(username) is entries:
+                self.resultcache.put(self.thresholdlesskey, username, password, entries)
+
+        return valid
+
+    def _check_entries(self, entries, password):
         # I'll check every share.   I probably could just check the first in almost
         # every case, but this shouldn't be a problem since only admins have
         # multiple shares.   Since these accounts are the most valuable (for what
         # they can access in the overall system), let's be thorough.
 
-        for entry in self.accountdict[username]:
-            saltedpasswordhash = self.hasher(entry['salt'] + password).digest()
+        for entry in entries:
+            saltedpasswordhash = self._hash_for_entry(entry, password)
 
             # If not unlocked, partial verification needs to be done here!
             if not self.knownsecret:
@@ -189,25 +357,283 @@ class PolyPasswordHasher(object):
 
             # If a thresholdless account...
             if entry['sharenumber'] == 0:
-                # return true if the password encrypts the same way...
-                cryptcheck = AES.new(self.thresholdlesskey).encrypt(saltedpasswordhash)
+                # true if the password encrypts the same way...
+                cryptcheck = self._cipher().encrypt(saltedpasswordhash)
                 entrycheck = entry['passhash'][:len(entry['passhash']) - self.partialbytes]
                 return cryptcheck == entrycheck
 
             # now we should have a shamir share (if all is well.)
             share = entry['sharenumber'], sharedata
 
-            # If a normal share, return T/F depending on if this share is valid.
+            # If a normal share, T/F depending on if this share is valid.
             return self.shamirsecretobj.is_valid_share(share)
 
-    def write_password_data(self, passwordfile):
-        """ Persist the password data to disk."""
+    def _expected_hash(self, entry):
+        """
+        Returns the salted hash a correct password gives for this entry.
+        This needs the secret.
+        """
+        passhash = entry['passhash'][:len(entry['passhash']) - self.partialbytes]
+
+        if entry['sharenumber'] == 0:
+            return self._cipher().decrypt(passhash)
+
+        return do_bytearray_xor(passhash, self.shamirsecretobj.compute_share(entry['sharenumber'])[1])
+
+    def _check_verifier_index(self, username, entries, password):
+        # Just like the loop in is_valid_login, the first entry decides.
+        expected = self.verifierindex.get(username, entries)
+        if expected is None:
+            expected = self.verifierindex.digest(self._expected_hash(entries[0]))
+            self.verifierindex.put(username, entries, expected)
+
+        return self.verifierindex.digest(self._hash_for_entry(entries[0], password)) == expected
+
+    def build_verifier_index(self, background=False):
+        """
+        Fills the verifier index (up to its size) rather than waiting for
+        each account's first login.   If background is set, this is done in
+        a thread, which is returned.
+        """
+        if not self.knownsecret:
+            raise ValueError("Password File is not unlocked!")
+
+        if self.verifierindex is None:
+            raise ValueError("No verifier index to build!")
+
+        def build():
+            verifierindex = self.verifierindex
+            for username in list(self.accountdict)[:verifierindex.maxsize]:
+                # locked again meanwhile, so there is no secret to use
+                if not self.knownsecret:
+                    break
+                # removed meanwhile
+                entries = self.accountdict.get(username)
+                if entries is None:
+                    continue
+                verifierindex.put(username, entries,
+                                  verifierindex.digest(self._expected_hash(entries[0])))
+
+        if not background:
+            build()
+            return None
+
+        thread = threading.Thread(target=build)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def write_password_data(self, passwordfile, records=False):
+        """ Persist the password data to disk.   With records=True, the file
+            is a stream of (username, entries) records that can be read an
+            account at a time, which older versions can't load."""
         if self.threshold >= self.nextavailableshare:
             raise ValueError("Would write undecodable password file.   Must have more shares before writing.")
 
         # Need more error checking in a real implementation
-        with open(passwordfile, 'wb') as outfile:
-            self.serializer.dump(self.accountdict, outfile)
+        _dump_password_data(self.serializer, self.accountdict, passwordfile, records)
+
+    def write_password_data_async(self, passwordfile, records=False):
+        """
+        Like write_password_data, but only a snapshot of the accounts is taken
+        here.   They are written out on a background thread.   Returns a
+        Future for the changesequence the snapshot was taken at.
+        passwordfile is replaced atomically.
+        """
+        if self.threshold >= self.nextavailableshare:
+            raise ValueError("Would write undecodable password file.   Must have more shares before writing.")
+
+        future = Future()
+        sequence = self.changesequence
+        snapshot = dict(self.accountdict)
+
+        def write():
+            try:
+                _dump_password_data(self.serializer, snapshot, passwordfile, records)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(sequence)
+
+        future.set_running_or_notify_cancel()
+        thread = threading.Thread(target=write)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def export_delta(self, since=None):
+        """
+        Returns the accounts changed after sequence number since (in the
+        order they were changed, with None as the entries of a removed
+        account) along with the share counter.   Pass this to
+        apply_delta on a standby that has applied everything up to since
+        from this object (that is, from this epoch).   With since None,
+        every account is sent, which brings any standby up to date.
+        """
+        if since is not None and since > self.changesequence:
+            raise ValueError("No changes after {0} yet, at {1}".format(since, self.changesequence))
+
+        changed = []
+        if since is None:
+            for username in list(self.accountdict):
+                changed.append((self.accountsequence.get(username, 0), username))
+        else:
+            for username in self.accountsequence:
+                if self.accountsequence[username] > since:
+                    changed.append((self.accountsequence[username], username))
+        changed.sort()
+
+        accounts = []
+        for sequence, username in changed:
+            accounts.append((sequence, username, self.accountdict.get(username)))
+
+        return {'epoch': self.epoch,
+                'since': since,
+                'sequence': self.changesequence,
+                'nextavailableshare': self.nextavailableshare,
+                'accounts': accounts}
+
+    def apply_delta(self, delta):
+        """
+        Applies a delta from export_delta in place.   This works whether or
+        not this object is unlocked.   Raises a ValueError if changes between
+        this object's sequence number and the delta's start would be missed,
+        or if the delta is from another epoch (say, the primary restarted).
+        Either way, a full delta (since None) is needed.
+        """
+        self._check_writable()
+
+        if delta['since'] is None:
+            # everything is sent, so anything else goes
+            for username in set(self.accountdict) - set(account[1] for account in delta['accounts']):
+                self.accountdict.pop(username, None)
+                self._forget_account(username)
+            self.accountsequence = {}
+            self.changesequence = 0
+            self.epoch = delta['epoch']
+
+        elif delta['epoch'] != self.epoch:
+            raise ValueError("Delta is from epoch {0!r}, not {1!r}.   A full resync is needed.".format(
+                delta['epoch'], self.epoch))
+
+        elif delta['since'] > self.changesequence:
+            raise ValueError("Delta starts after {0} but this is only at {1}".format(
+                delta['since'], self.changesequence))
+
+        for sequence, username, entries in delta['accounts']:
+            if entries is None:
+                self.accountdict.pop(username, None)
+            else:
+                self.accountdict[username] = entries
+            self.accountsequence[username] = sequence
+            self._forget_account(username)
+
+        self.nextavailableshare = max(self.nextavailableshare, delta['nextavailableshare'])
+        self.changesequence = max(self.changesequence, delta['sequence'])
+
+    def write_delta(self, outfile, since=None):
+        """
+        Writes export_delta(since) to an open file (or pipe, socket file...)
+        as one line of JSON.   Unlike the password file, this is plain data,
+        so reading it can't run code from whoever is on the other end.
+        """
+        delta = self.export_delta(since)
+        delta['accounts'] = [(sequence, username, _encode_entries(entries))
+                             for sequence, username, entries in delta['accounts']]
+        outfile.write(json.dumps(delta, sort_keys=True).encode('utf8') + b'\n')
+        outfile.flush()
+
+    def read_delta(self, infile):
+        """Reads a delta written by write_delta and applies it."""
+        line = infile.readline()
+        if not line.endswith(b'\n'):
+            raise ValueError("Truncated delta")
+
+        try:
+            delta = json.loads(line.decode('utf8'))
+            delta = {'epoch': delta['epoch'],
+                     'since': None if delta['since'] is None else int(delta['since']),
+                     'sequence': int(delta['sequence']),
+                     'nextavailableshare': int(delta['nextavailableshare']),
+                     'accounts': [(int(sequence), username, _decode_entries(entries))
+                                  for sequence, username, entries in delta['accounts']]}
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError("Invalid delta: {0}".format(e))
+
+        self.apply_delta(delta)
+
+    def reload_password_data(self, passwordfile, background=False, unchecked=False):
+        """
+        Replaces all of the accounts with those in passwordfile without
+        locking.   The new file is read and checked first and then swapped
+        in at once, so logins being checked meanwhile see either the old or
+        the new accounts.   Accounts created here in the meantime are lost.
+
+        Every entry must decode with the secret already recovered (the
+        partial bytes must match), so a file from some other store is
+        refused with a ValueError.   That takes an unlocked object with
+        partial verification on.   Otherwise this raises a ValueError
+        unless unchecked is set.   If background is set, this returns a
+        Future and does the work in a thread.
+        """
+        if not (self.knownsecret and self.partialbytes) and not unchecked:
+            raise ValueError("Can't check the new entries against the secret!   "
+                             "Unlock with partial verification on or pass unchecked=True.")
+
+        if background:
+            future = Future()
+
+            def reload():
+                if not future.set_running_or_notify_cancel():
+                    return
+                try:
+                    self.reload_password_data(passwordfile, unchecked=unchecked)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(None)
+
+            thread = threading.Thread(target=reload)
+            thread.daemon = True
+            thread.start()
+            return future
+
+        self._check_writable()
+        newaccountdict = dict(iter_password_file(passwordfile, self.serializer))
+
+        maxshare = 0
+        sharesseen = set()
+        for username in newaccountdict:
+            for entry in newaccountdict[username]:
+                self._check_reloaded_entry(username, entry)
+                if entry['sharenumber'] in sharesseen:
+                    raise ValueError("Share {0} is used twice".format(entry['sharenumber']))
+                if entry['sharenumber'] != 0:
+                    sharesseen.add(entry['sharenumber'])
+                maxshare = max(maxshare, entry['sharenumber'])
+
+        oldaccountdict = self.accountdict
+        self.accountdict = newaccountdict
+        self.nextavailableshare = max(self.nextavailableshare, maxshare + 1)
+
+        # tell the standbys (and the verifier index) what changed
+        for username in set(oldaccountdict) | set(newaccountdict):
+            if oldaccountdict.get(username) != newaccountdict.get(username):
+                self._note_change(username)
+
+    def _check_reloaded_entry(self, username, entry):
+        if not 0 <= entry['sharenumber'] <= 255:
+            raise ValueError("Invalid share number for {0!r}: {1}".format(username, entry['sharenumber']))
+
+        # every algorithm gives 32 bytes, followed by the partial bytes
+        if len(entry['passhash']) != 32 + self.partialbytes:
+            raise ValueError("Wrong passhash length for {0!r}".format(username))
+
+        if self.knownsecret and self.partialbytes:
+            expected = self._expected_hash(entry)
+            if bytes(expected[len(expected) - self.partialbytes:]) != \
+                    entry['passhash'][len(entry['passhash']) - self.partialbytes:]:
+                raise ValueError("Entry for {0!r} does not decode with this secret".format(username))
 
     def unlock_password_data(self, logindata):
         """Pass this a list of username, password tuples like: [('admin',
@@ -218,6 +644,13 @@ class PolyPasswordHasher(object):
             raise ValueError("Password File is already unlocked!")
         # Okay, I need to find the shares first and then see if I can recover the
         # secret using this.
+        self.unlock_with_shares(self.compute_unlock_shares(logindata))
+
+    def compute_unlock_shares(self, logindata):
+        """Returns the (sharenumber, sharedata) shares that the username,
+           password tuples in logindata decode to.   These can be combined
+           with shares from elsewhere (see coordinator.py) and given to
+           unlock_with_shares.   Nothing is checked until then."""
 
         sharelist = []
 
@@ -233,13 +666,22 @@ class PolyPasswordHasher(object):
                 if entry['sharenumber'] == 0:
                     continue
 
-                thissaltedpasswordhash = self.hasher(entry['salt'] + password).digest()
+                thissaltedpasswordhash = self._hash_for_entry(entry, password)
                 thisshare = (entry['sharenumber'],
                              do_bytearray_xor(thissaltedpasswordhash,
                                               entry['passhash'][:len(entry['passhash'])
                                                                 - self.partialbytes]))
                 sharelist.append(thisshare)
 
+        return sharelist
+
+    def unlock_with_shares(self, sharelist):
+        """Unlocks the password file given at least threshold correct
+           shares."""
+
+        if self.knownsecret:
+            raise ValueError("Password File is already unlocked!")
+
         # This will raise a ValueError if a share is incorrect or there are other
         # issues (like not enough shares).
         self.shamirsecretobj.recover_secretdata(sharelist)
@@ -248,8 +690,123 @@ class PolyPasswordHasher(object):
         # it worked!
         self.knownsecret = True
 
+    def lock_password_data(self):
+        """Forgets the secret (and everything cached with it), so threshold
+           logins are needed to unlock the password file again."""
+
+        self.knownsecret = False
+        self.thresholdlesskey = None
+        self._thresholdlesscipher = None
+        self.shamirsecretobj = ShamirSecret(self.threshold)
+
+        if self.verifierindex is not None:
+            self.verifierindex.clear()
+        if self.resultcache is not None:
+            self.resultcache.clear()
+
+
+def iter_password_file(passwordfile, serializer=pickle):
+    """
+    Yields (username, entries) pairs from a password file.   This reads the
+    single pickled dict that write_password_data writes by default, and the
+    stream of (username, entries) records written by
+    write_password_data(records=True) and migrate.migrate_accounts one record
+    at a time.
+    """
+    with open(passwordfile, 'rb') as infile:
+        try:
+            record = serializer.load(infile)
+        except EOFError:
+            return
+
+        if isinstance(record, dict):
+            for username in record:
+                yield username, record[username]
+            return
+
+        while True:
+            if not isinstance(record, tuple) or len(record) != 2:
+                raise ValueError("Invalid password file record: {0!r}".format(record))
+            yield record
+
+            try:
+                record = serializer.load(infile)
+            except EOFError:
+                return
+
+
+def _dump_password_data(serializer, accountdict, passwordfile, records=False):
+    """
+    Writes accountdict (or, with records, a stream of (username, entries)
+    records that can be read back an account at a time) to a temporary file
+    next to passwordfile and renames it over passwordfile, so readers see
+    either the old or the new file.
+    """
+    directory, filename = os.path.split(os.path.abspath(passwordfile))
+    fd, tempname = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            if records:
+                for username, entries in list(accountdict.items()):
+                    serializer.dump((username, entries), outfile)
+            else:
+                serializer.dump(accountdict, outfile)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(tempname, passwordfile)
+    except BaseException:
+        if os.path.exists(tempname):
+            os.remove(tempname)
+        raise
+
+
+def iter_entries(accounts):
+    """
+    Yields (username, entry) for every entry of the (username, entries) pairs
+    from iter_password_file or PolyPasswordHasher.iter_accounts.
+    """
+    for username, entries in accounts:
+        for entry in entries:
+            yield username, entry
+
 
 #### Private helper...
+
+# entry fields holding bytes, which are sent as hex in deltas
+_BINARYFIELDS = ('salt', 'passhash')
+
+
+def _encode_entries(entries):
+    if entries is None:
+        return None
+    encoded = []
+    for entry in entries:
+        entry = dict(entry)
+        for field in _BINARYFIELDS:
+            entry[field] = binascii.hexlify(bytes(entry[field])).decode('ascii')
+        encoded.append(entry)
+    return encoded
+
+
+def _decode_entries(encoded):
+    if encoded is None:
+        return None
+    entries = []
+    for entry in encoded:
+        if set(entry) - set(['sharenumber', 'salt', 'passhash', 'algorithm', 'params']):
+            raise ValueError("Unexpected entry fields: {0!r}".format(sorted(entry)))
+        entry = dict(entry)
+        entry['sharenumber'] = int(entry['sharenumber'])
+        for field in _BINARYFIELDS:
+            entry[field] = binascii.unhexlify(entry[field])
+        if 'algorithm' in entry:
+            entry['algorithm'] = str(entry['algorithm'])
+            if not isinstance(entry['params'], dict):
+                raise ValueError("Invalid params: {0!r}".format(entry['params']))
+        entries.append(entry)
+    return entries
+
+
 def do_bytearray_xor(a, b):
     a = bytearray(a)
     b = bytearray(b)
@@ -0,0 +1,167 @@
+"""
+A compact table of partial verification data for edge nodes.
+
+With partial verification on, a locked PolyPasswordHasher can already turn
+away most wrong passwords using only each entry's salt and the last
+partialbytes of its salted hash.   export_prefilter writes just that (for
+the first entry of each account, which is what is_valid_login checks) to a
+file, and PrefilterVerifier does the same check against it through mmap, so
+obviously wrong passwords can be dropped before they reach the nodes with
+the real password file.   Passing the prefilter proves nothing by itself.
+
+The file is a header followed by fixed size records sorted by a digest of
+the username:
+
+  magic (8 bytes) | header length (4 bytes, big endian) | JSON header
+  records: username digest (16) | algorithm index (1) | salt | partial bytes
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from .hashers import ALGORITHMS, salted_hash
+from .shamirsecret import PY3
+
+MAGIC = b'PPHPREF1'
+
+# bytes of sha256(username) used to look accounts up
+USERDIGESTSIZE = 16
+
+
+def export_prefilter(pph, prefilterfile):
+    """
+    Writes the prefilter table for pph (locked or not) to prefilterfile.
+    The file is replaced atomically.
+    """
+    if pph.partialbytes <= 0:
+        raise ValueError("Partial verification is disabled!")
+
+    algorithms = []
+    saltsize = None
+    records = []
+
+    for username, entries in pph.iter_accounts():
+        entry = entries[0]
+
+        if 'algorithm' in entry:
+            algorithm = [entry['algorithm'], entry['params']]
+        elif pph.hasher().name in ALGORITHMS:
+            # untagged entries were hashed with pph.hasher
+            algorithm = [pph.hasher().name, {}]
+        else:
+            raise ValueError("Can't export entries hashed with {0!r}".format(pph.hasher))
+
+        if algorithm not in algorithms:
+            if len(algorithms) == 256:
+                raise ValueError("Too many different algorithms")
+            algorithms.append(algorithm)
+
+        if saltsize is None:
+            saltsize = len(entry['salt'])
+        if len(entry['salt']) != saltsize:
+            raise ValueError("Salts of different sizes: {0!r}".format(username))
+
+        records.append(_userdigest(username) +
+                       struct.pack('>B', algorithms.index(algorithm)) +
+                       bytes(entry['salt']) +
+                       bytes(entry['passhash'][len(entry['passhash']) - pph.partialbytes:]))
+
+    records.sort()
+
+    header = json.dumps({'partialbytes': pph.partialbytes,
+                         'saltsize': saltsize or 0,
+                         'count': len(records),
+                         'algorithms': algorithms}, sort_keys=True).encode('utf8')
+
+    # just like pph._dump_password_data: a temporary file of its own next to
+    # prefilterfile, synced before it replaces it
+    directory, filename = os.path.split(os.path.abspath(prefilterfile))
+    fd, tempname = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(MAGIC + struct.pack('>I', len(header)) + header)
+            for record in records:
+                outfile.write(record)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.rename(tempname, prefilterfile)
+    except BaseException:
+        if os.path.exists(tempname):
+            os.remove(tempname)
+        raise
+
+
+class PrefilterVerifier(object):
+    """
+    Checks passwords against a table written by export_prefilter, the same
+    way a locked PolyPasswordHasher with partial verification does.
+    """
+
+    def __init__(self, prefilterfile):
+        with open(prefilterfile, 'rb') as infile:
+            self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a prefilter file: {0}".format(prefilterfile))
+
+        headerlength = struct.unpack('>I', self._map[len(MAGIC):len(MAGIC) + 4])[0]
+        self._start = len(MAGIC) + 4 + headerlength
+        header = json.loads(self._map[len(MAGIC) + 4:self._start].decode('utf8'))
+
+        self.partialbytes = header['partialbytes']
+        self.saltsize = header['saltsize']
+        self.count = header['count']
+        self.algorithms = header['algorithms']
+        self._recordsize = USERDIGESTSIZE + 1 + self.saltsize + self.partialbytes
+
+        if len(self._map) != self._start + self.count * self._recordsize:
+            raise ValueError("Truncated prefilter file: {0}".format(prefilterfile))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._map.close()
+
+    def is_plausible_login(self, username, password):
+        """
+        Returns False if the password is certainly wrong (or the user is
+        unknown) and True if it may be right.
+        """
+        record = self._find(_userdigest(username))
+        if record is None:
+            return False
+
+        if PY3:
+            password = bytes(password, encoding='utf8')
+
+        algorithm, params = self.algorithms[bytearray(record[USERDIGESTSIZE:USERDIGESTSIZE + 1])[0]]
+        salt = record[USERDIGESTSIZE + 1:USERDIGESTSIZE + 1 + self.saltsize]
+        partial = record[USERDIGESTSIZE + 1 + self.saltsize:]
+
+        saltedpasswordhash = salted_hash(algorithm, params, salt, password)
+        return saltedpasswordhash[len(saltedpasswordhash) - self.partialbytes:] == partial
+
+    def _find(self, userdigest):
+        # binary search over the sorted records
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = self._start + middle * self._recordsize
+            thisdigest = self._map[offset:offset + USERDIGESTSIZE]
+            if thisdigest == userdigest:
+                return self._map[offset:offset + self._recordsize]
+            if thisdigest < userdigest:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+def _userdigest(username):
+    if PY3:
+        username = username.encode('utf8')
+    return hashlib.sha256(username).digest()[:USERDIGESTSIZE]
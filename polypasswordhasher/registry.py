@@ -0,0 +1,313 @@
+"""
+Hosts the password stores of many tenants in one process.
+
+Stores are loaded from a directory (one password file per tenant) the first
+time they are used, and the least recently used ones are unloaded once more
+than maxloaded are in memory (or when they have been idle too long).   If
+keepunlocked is set, an unlocked store that is unloaded leaves behind
+threshold shares of its secret, so it comes back unlocked without admin
+logins.   Stores with changes are written out before they are unloaded.
+
+A store from get() may be unloaded by any later call, after which it
+refuses changes.   To change a store, lease() it: a leased store is never
+unloaded.
+
+What can be shared between stores is: the GF256 tables are module level,
+and bulk hashing (migrate) runs on the registry's single pool.   AES cipher
+objects can't be shared since every store has its own key, but each store
+keeps one rather than making one per login.
+"""
+import contextlib
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .migrate import migrate_accounts
+from .pph import PolyPasswordHasher
+
+
+class PasswordStoreRegistry(object):
+    """
+    Lazily loads the PolyPasswordHasher of each tenant from directory and
+    keeps at most maxloaded of them in memory.
+    """
+
+    def __init__(self, threshold, directory, maxloaded=1000, keepunlocked=False, partialbytes=0,
+                 processes=None):
+        self.threshold = threshold
+        self.directory = directory
+        self.maxloaded = maxloaded
+        self.keepunlocked = keepunlocked
+        self.partialbytes = partialbytes
+        self.processes = processes
+
+        # tenant -> PolyPasswordHasher, least recently used first
+        self._stores = OrderedDict()
+        # tenant -> time it was last used
+        self._lastused = {}
+        # tenant -> the changesequence the tenant's file was written at
+        self._written = {}
+        # tenant -> threshold shares of an unloaded store's secret
+        self._secrets = {}
+        # tenant -> number of leases on it
+        self._leases = {}
+        # tenants being loaded or written out.   Files are read and written
+        # without holding the lock, and others wait on _idle for them.
+        self._busy = set()
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+        self.hits = 0
+        self.loads = 0
+        self.unloads = 0
+        self.writes = 0
+
+    def path(self, tenant):
+        """Returns the password file for a tenant."""
+        if not tenant or tenant.startswith('.') or os.sep in tenant or (os.altsep and os.altsep in tenant):
+            raise ValueError("Invalid tenant name: {0!r}".format(tenant))
+        return os.path.join(self.directory, tenant)
+
+    def get(self, tenant):
+        """Returns the tenant's store, loading it if needed.   Use lease()
+           to change it."""
+        with self._lock:
+            self._wait_idle(tenant)
+            pph = self._stores.pop(tenant, None)
+            if pph is not None:
+                self.hits += 1
+                self._stores[tenant] = pph
+                self._lastused[tenant] = time.time()
+            else:
+                passwordfile = self.path(tenant)
+                shares = self._secrets.pop(tenant, None)
+                self._busy.add(tenant)
+
+        if pph is None:
+            try:
+                pph = PolyPasswordHasher(self.threshold, passwordfile, self.partialbytes)
+                if shares is not None:
+                    pph.unlock_with_shares(shares)
+            except BaseException:
+                with self._lock:
+                    self._done(tenant)
+                raise
+
+            with self._lock:
+                self._stores[tenant] = pph
+                self._lastused[tenant] = time.time()
+                self._written[tenant] = pph.changesequence
+                self.loads += 1
+                self._done(tenant)
+
+        self._evict(self.maxloaded, tenant)
+        return pph
+
+    @contextlib.contextmanager
+    def lease(self, tenant):
+        """
+        Gives the tenant's store for a with block, during which it stays
+        loaded:
+
+          with registry.lease('acme') as pph:
+              pph.create_account('bob', 'puppy', 1)
+        """
+        while True:
+            pph = self.get(tenant)
+            with self._lock:
+                # unless it was unloaded (or is being) since
+                if self._stores.get(tenant) is pph and tenant not in self._busy:
+                    self._leases[tenant] = self._leases.get(tenant, 0) + 1
+                    break
+        try:
+            yield pph
+        finally:
+            with self._lock:
+                self._leases[tenant] -= 1
+                if not self._leases[tenant]:
+                    del self._leases[tenant]
+            self._evict(self.maxloaded, None)
+
+    def create(self, tenant):
+        """Starts a new (unlocked) store for a tenant.   It is written out
+           when it is unloaded or by write()."""
+        with self._lock:
+            self._wait_idle(tenant)
+            if tenant in self._stores or os.path.exists(self.path(tenant)):
+                raise ValueError("Tenant exists already: {0!r}".format(tenant))
+
+            pph = PolyPasswordHasher(self.threshold, None, self.partialbytes)
+            self._stores[tenant] = pph
+            self._lastused[tenant] = time.time()
+            self._written[tenant] = None
+        self._evict(self.maxloaded, tenant)
+        return pph
+
+    def migrate(self, tenant, credentials, chunksize=1000):
+        """
+        Makes a new tenant from (username, password, shares) credentials
+        with migrate.migrate_accounts, hashing on the registry's pool.   The
+        store is loaded (locked, unless keepunlocked is set) on first use.
+        Returns the number of accounts.
+        """
+        with self._lock:
+            if tenant in self._stores or os.path.exists(self.path(tenant)):
+                raise ValueError("Tenant exists already: {0!r}".format(tenant))
+        pool = self.pool
+
+        pph = PolyPasswordHasher(self.threshold, None, self.partialbytes)
+        count = migrate_accounts(pph, credentials, self.path(tenant), chunksize, pool=pool)
+
+        if self.keepunlocked:
+            with self._lock:
+                self._secrets[tenant] = [pph.shamirsecretobj.compute_share(sharenumber)
+                                         for sharenumber in range(1, self.threshold + 1)]
+        return count
+
+    def write(self, tenant):
+        """Writes a loaded tenant's store out if it has changed."""
+        with self._lock:
+            self._wait_idle(tenant)
+            pph = self._stores[tenant]
+            sequence = pph.changesequence
+            if self._written[tenant] == sequence:
+                return
+            self._busy.add(tenant)
+
+        try:
+            pph.write_password_data(self.path(tenant))
+        except BaseException:
+            with self._lock:
+                self._done(tenant)
+            raise
+
+        with self._lock:
+            # anything changed while it was written is written next time
+            self._written[tenant] = sequence
+            self.writes += 1
+            self._done(tenant)
+
+    def unload(self, tenant):
+        """Writes out and forgets a loaded store, which then refuses
+           changes.   Raises a ValueError (and keeps it) if it is leased or
+           has changes that can't be written yet."""
+        with self._lock:
+            self._wait_idle(tenant)
+            if tenant in self._leases:
+                raise ValueError("Tenant is leased: {0!r}".format(tenant))
+            pph = self._stores[tenant]
+            self._busy.add(tenant)
+
+            # no more changes from here on, so the file has all of them
+            wasreadonly = pph.readonly
+            pph.readonly = True
+            changed = self._written[tenant] != pph.changesequence
+
+        try:
+            if changed:
+                pph.write_password_data(self.path(tenant))
+        except BaseException:
+            with self._lock:
+                pph.readonly = wasreadonly
+                self._done(tenant)
+            raise
+
+        with self._lock:
+            if changed:
+                self.writes += 1
+            del self._stores[tenant]
+            del self._lastused[tenant]
+            del self._written[tenant]
+
+            if self.keepunlocked and pph.knownsecret:
+                self._secrets[tenant] = [pph.shamirsecretobj.compute_share(sharenumber)
+                                         for sharenumber in range(1, self.threshold + 1)]
+            self.unloads += 1
+            self._done(tenant)
+
+    def unload_idle(self, maxidle):
+        """Unloads every store that hasn't been used for maxidle seconds."""
+        with self._lock:
+            cutoff = time.time() - maxidle
+            idle = [tenant for tenant in self._stores if self._lastused[tenant] <= cutoff]
+        for tenant in idle:
+            self._try_unload(tenant)
+
+    def forget_secrets(self):
+        """Drops the secrets kept for unloaded stores."""
+        with self._lock:
+            self._secrets.clear()
+
+    @property
+    def pool(self):
+        """A process pool shared by every tenant for bulk work."""
+        with self._lock:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def close(self):
+        """Writes out and unloads every store and stops the pool."""
+        with self._lock:
+            tenants = list(self._stores)
+        for tenant in tenants:
+            self.unload(tenant)
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': len(self._stores),
+                'unlocked': sum(1 for pph in self._stores.values() if pph.knownsecret),
+                'keptsecrets': len(self._secrets),
+                'leased': len(self._leases),
+                'accounts': sum(len(pph.accountdict) for pph in self._stores.values()),
+                'hits': self.hits,
+                'loads': self.loads,
+                'unloads': self.unloads,
+                'writes': self.writes,
+            }
+
+    def _evict(self, size, keep):
+        # least recently used first, skipping leased ones and ones that
+        # can't be written yet.   The victims are picked under the lock and
+        # written out after it is released.
+        skipped = set([keep])
+        while True:
+            with self._lock:
+                excess = len(self._stores) - size
+                victims = [tenant for tenant in self._stores
+                           if tenant not in skipped and tenant not in self._leases
+                           and tenant not in self._busy][:max(excess, 0)]
+            if not victims:
+                return
+            for tenant in victims:
+                if not self._try_unload(tenant):
+                    skipped.add(tenant)
+
+    def _try_unload(self, tenant):
+        # False if it couldn't be (or was already) unloaded
+        try:
+            self.unload(tenant)
+        except (ValueError, KeyError):
+            return False
+        return True
+
+    def _wait_idle(self, tenant):
+        # with the lock held, until nobody is loading or writing tenant
+        while tenant in self._busy:
+            self._idle.wait()
+
+    def _done(self, tenant):
+        # with the lock held
+        self._busy.discard(tenant)
+        self._idle.notify_all()
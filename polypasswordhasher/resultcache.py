@@ -0,0 +1,116 @@
+"""
+A short lived cache of successful logins for an unlocked password file.
+
+Clients that log in over and over with the same password (token refreshes,
+re-authentication) would otherwise pay for the salted hash, and for a
+threshold account the share check, on every request.   With a ResultCache
+set as PolyPasswordHasher.resultcache, a successful login is remembered for
+ttl seconds and repeating it costs two HMACs.
+
+Entries are keyed by an HMAC of the username and password whose key is
+derived from the recovered secret, so nothing in the cache can be used to
+check a password without the secret.   Only successful logins are kept (a
+flood of wrong guesses can't push them out), an entry only counts for the
+entries list it was checked against, and the cache is emptied when the
+password file is locked again.
+"""
+import hashlib
+import hmac
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from .shamirsecret import PY3
+
+
+class ResultCache(object):
+    """
+    Remembers up to maxsize successful logins, each for ttl seconds.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+
+        # derived from the secret the cache was last used with
+        self._key = None
+
+        # mac -> (username, entries, expiry time), least recently used first
+        self._results = OrderedDict()
+        # username -> set of macs, so one account can be invalidated
+        self._usermacs = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, secret, username, password, entries):
+        """
+        Returns True if this password was accepted for username (with this
+        very entries list) within the last ttl seconds.
+        """
+        with self._lock:
+            mac = self._mac(secret, username, password)
+            item = self._results.pop(mac, None)
+            if item is None or item[1] is not entries or item[2] <= time.time():
+                if item is not None:
+                    self._usermacs[username].discard(mac)
+                self.misses += 1
+                return False
+
+            self._results[mac] = item
+            self.hits += 1
+            return True
+
+    def put(self, secret, username, password, entries):
+        """Remembers that password was accepted for username."""
+        with self._lock:
+            mac = self._mac(secret, username, password)
+            self._results.pop(mac, None)
+            self._results[mac] = (username, entries, time.time() + self.ttl)
+            self._usermacs.setdefault(username, set()).add(mac)
+            self._shrink(self.maxsize)
+
+    def invalidate(self, username):
+        with self._lock:
+            for mac in self._usermacs.pop(username, ()):
+                self._results.pop(mac, None)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def shrink(self, size):
+        """Evicts the least recently used logins until at most size are left."""
+        with self._lock:
+            self._shrink(size)
+
+    def _mac(self, secret, username, password):
+        key = hmac.new(bytes(secret), b'PolyPasswordHasher result cache', hashlib.sha256).digest()
+        if key != self._key:
+            # a different secret, so nothing cached so far can match
+            self._clear()
+            self._key = key
+
+        if PY3:
+            username = username.encode('utf8')
+        # the length keeps ('ab', 'c') and ('a', 'bc') apart
+        message = struct.pack('>I', len(username)) + username + bytes(password)
+        return hmac.new(key, message, hashlib.sha256).digest()
+
+    def _clear(self):
+        self._results.clear()
+        self._usermacs.clear()
+
+    def _shrink(self, size):
+        while len(self._results) > max(size, 0):
+            mac, (username, _, _) = self._results.popitem(last=False)
+            self._usermacs[username].discard(mac)
+            if not self._usermacs[username]:
+                del self._usermacs[username]
+            self.evictions += 1
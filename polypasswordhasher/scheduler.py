@@ -0,0 +1,255 @@
+"""
+Admission control in front of PolyPasswordHasher.is_valid_login.
+
+Logins are queued by priority class and checked by a fixed set of worker
+threads.   The queue is bounded: when it is full, requests that are past
+their deadline are dropped (without hashing anything) and then the newest
+request of the lowest priority class is shed (or the new request is, if
+nothing queued is less important).   Each class is a deque and deadlines
+are kept in a heap, so all of this takes about constant time however full
+the queue is.   Share-holding accounts (which include
+the admins whose logins unlock the store) go first, then thresholdless
+accounts, then unknown usernames, so a flood of guesses can't starve them.
+"""
+import collections
+import heapq
+import itertools
+import threading
+import time
+
+from concurrent.futures import Future
+
+
+# priority classes, most important first
+PRIORITY_SHARES = 0
+PRIORITY_THRESHOLDLESS = 1
+PRIORITY_UNKNOWN = 2
+
+
+class Overloaded(Exception):
+    """The request was shed because the queue was full."""
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before it was checked."""
+
+
+class _Request(object):
+    __slots__ = ['priority', 'deadline', 'submitted', 'future', 'username', 'password', 'queued']
+
+    def __init__(self, priority, deadline, submitted, future, username, password):
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted = submitted
+        self.future = future
+        self.username = username
+        self.password = password
+        # cleared when the request leaves the queue.   Requests are left in
+        # the deques and the deadline heap and skipped after that.
+        self.queued = True
+
+
+class VerificationScheduler(object):
+    """
+    Checks logins against pph with the given number of worker threads,
+    keeping at most maxqueue waiting.
+    """
+
+    # number of recent latencies per priority class kept for percentiles
+    latencysamples = 1000
+
+    def __init__(self, pph, workers=4, maxqueue=1000, timeout=None):
+        self.pph = pph
+        self.maxqueue = maxqueue
+        # default seconds a request may wait, None for no deadline
+        self.timeout = timeout
+
+        # priority class -> deque of _Requests, oldest first
+        self._queues = collections.defaultdict(collections.deque)
+        # (deadline, order, _Request) for requests with a deadline
+        self._deadlines = []
+        self._order = itertools.count()
+        self._queued = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.shed = 0
+        self.expired = 0
+        self.maxqueued = 0
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.latencysamples))
+
+        self._workers = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def priority(self, username):
+        """Returns the priority class of username, from its entries' sharenumbers."""
+        entries = self.pph.accountdict.get(username)
+        if not entries:
+            return PRIORITY_UNKNOWN
+        if any(entry['sharenumber'] != 0 for entry in entries):
+            return PRIORITY_SHARES
+        return PRIORITY_THRESHOLDLESS
+
+    def submit(self, username, password, timeout=None, priority=None):
+        """
+        Queues a login check and returns a Future for the result of
+        is_valid_login.   It raises Overloaded if the request is shed and
+        DeadlineExceeded if it waits more than timeout seconds (or the
+        default) in the queue.
+        """
+        if priority is None:
+            priority = self.priority(username)
+        if timeout is None:
+            timeout = self.timeout
+
+        now = time.time()
+        deadline = None if timeout is None else now + timeout
+        future = Future()
+        request = _Request(priority, deadline, now, future, username, password)
+
+        with self._condition:
+            if self._closed:
+                raise ValueError("Scheduler is closed!")
+
+            self.submitted += 1
+            self._expire(now)
+
+            if self._queued >= self.maxqueue:
+                # the newest of the least important requests goes
+                victim = self._pop(last=True) if self._queued else None
+                if victim is None or victim.priority <= priority:
+                    if victim is not None:
+                        # put it back where it was
+                        victim.queued = True
+                        self._queues[victim.priority].append(victim)
+                        self._queued += 1
+                    self.shed += 1
+                    future.set_exception(Overloaded("Queue is full"))
+                    return future
+
+                self.shed += 1
+                victim.future.set_exception(Overloaded("Queue is full"))
+
+            self._queues[priority].append(request)
+            self._queued += 1
+            if deadline is not None:
+                heapq.heappush(self._deadlines, (deadline, next(self._order), request))
+            self.maxqueued = max(self.maxqueued, self._queued)
+            self._condition.notify()
+
+        return future
+
+    def is_valid_login(self, username, password, timeout=None, priority=None):
+        """Like PolyPasswordHasher.is_valid_login, but through the queue."""
+        return self.submit(username, password, timeout, priority).result()
+
+    def close(self):
+        """Stops the workers.   Anything still queued is cancelled."""
+        with self._condition:
+            self._closed = True
+            for queue in self._queues.values():
+                for request in queue:
+                    if request.queued:
+                        request.future.cancel()
+            self._queues.clear()
+            self._deadlines = []
+            self._queued = 0
+            self._condition.notify_all()
+
+        for worker in self._workers:
+            worker.join()
+
+    def stats(self):
+        with self._condition:
+            latencies = {}
+            for priority in self._latencies:
+                samples = sorted(self._latencies[priority])
+                latencies[priority] = {
+                    'count': len(samples),
+                    'mean': sum(samples) / len(samples),
+                    'p50': samples[len(samples) // 2],
+                    'p99': samples[min(len(samples) - 1, len(samples) * 99 // 100)],
+                    'max': samples[-1],
+                }
+
+            return {
+                'queued': self._queued,
+                'maxqueued': self.maxqueued,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'shed': self.shed,
+                'expired': self.expired,
+                'latency': latencies,
+            }
+
+    def _pop(self, last=False):
+        # Takes the oldest request of the most important class (or the
+        # newest of the least important one).   Call with the condition held
+        # and something queued.
+        while True:
+            priority = max(self._queues) if last else min(self._queues)
+            queue = self._queues[priority]
+            while queue:
+                request = queue.pop() if last else queue.popleft()
+                if request.queued:
+                    request.queued = False
+                    self._queued -= 1
+                    if not queue:
+                        del self._queues[priority]
+                    return request
+            # only expired requests were left in this class
+            del self._queues[priority]
+
+    def _expire(self, now):
+        # Drops the queued requests whose deadline has passed.   Call with
+        # the condition held.
+        while self._deadlines and self._deadlines[0][0] < now:
+            request = heapq.heappop(self._deadlines)[2]
+            if request.queued:
+                request.queued = False
+                self._queued -= 1
+                self.expired += 1
+                request.future.set_exception(DeadlineExceeded("Waited {0:.3f}s".format(now - request.submitted)))
+
+        # requests that were checked in time are only dropped from the heap
+        # once their deadline passes, so rebuild it if it is mostly those
+        if len(self._deadlines) > 2 * self._queued + 64:
+            self._deadlines = [item for item in self._deadlines if item[2].queued]
+            heapq.heapify(self._deadlines)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queued and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                request = self._pop()
+
+            if not request.future.set_running_or_notify_cancel():
+                continue
+
+            if request.deadline is not None and time.time() > request.deadline:
+                with self._condition:
+                    self.expired += 1
+                request.future.set_exception(DeadlineExceeded("Waited {0:.3f}s".format(
+                    time.time() - request.submitted)))
+                continue
+
+            try:
+                result = self.pph.is_valid_login(request.username, request.password)
+            except Exception as e:
+                request.future.set_exception(e)
+            else:
+                request.future.set_result(result)
+
+            with self._condition:
+                self.completed += 1
+                self._latencies[request.priority].append(time.time() - request.submitted)
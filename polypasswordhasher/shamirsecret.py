@@ -161,6 +161,137 @@ class ShamirSecret(object):
 
 ####################### END OF MAIN CLASS #######################
 
+### Streaming split / combine for secrets too large to hold in memory.
+#
+# These share the data a chunk at a time.   Each byte of the secret still
+# gets its own random polynomial (like in ShamirSecret), but rather than
+# calling _f per byte, a chunk is multiplied by a constant all at once with
+# bytes.translate and a 256 byte multiplication table built from the GF256
+# tables below.   Every share stream starts with a single byte holding its x.
+
+def split_stream(threshold, instream, outstreams, chunksize=65536):
+    """
+    Reads the secret from instream and writes one share to each of
+    outstreams (the first gets x = 1, the next x = 2, ...).   Any threshold
+    of them can be passed to combine_streams to get the secret back.
+    """
+    if threshold < 1 or threshold > len(outstreams):
+        raise ValueError("Threshold: {0} must be between 1 and the number of shares: {1}".format(threshold, len(outstreams)))
+
+    if len(outstreams) >= 256:
+        raise ValueError("Too many shares: {0}".format(len(outstreams)))
+
+    multables = []
+    for x in range(1, len(outstreams) + 1):
+        multables.append(_gf256_multable(x))
+        outstreams[x - 1].write(bytes(bytearray([x])))
+
+    while True:
+        chunk = instream.read(chunksize)
+        if not chunk:
+            break
+        chunk = bytes(chunk)
+
+        # the first coefficient is the secret itself.   The next threshold-1
+        # are (crypto) random, a fresh one for each byte.
+        coefficients = [chunk]
+        for _ in range(threshold - 1):
+            coefficients.append(os.urandom(len(chunk)))
+
+        for multable, outstream in zip(multables, outstreams):
+            outstream.write(_f_chunk(multable, coefficients))
+
+
+def combine_streams(threshold, instreams, outstream, chunksize=65536):
+    """
+    Recovers a secret split with split_stream from at least threshold of its
+    share streams and writes it to outstream.   Just like recover_secretdata,
+    if more than threshold shares are given, the extra ones must agree with
+    the others or a ValueError is raised.
+    """
+    if threshold > len(instreams):
+        raise ValueError("Threshold: {0} is smaller than the number of shares: {1}.".format(threshold, len(instreams)))
+
+    xs = []
+    for instream in instreams:
+        header = bytearray(_read_fully(instream, 1))
+        if len(header) != 1 or header[0] == 0:
+            raise ValueError("Share stream is missing its x")
+        if header[0] in xs:
+            raise ValueError("Different shares with the same first byte! {0!r}".format(header[0]))
+        xs.append(header[0])
+
+    # The secret is the polynomial through the first threshold shares at 0.
+    # The extra shares are checked against the same polynomial at their x.
+    usedxs = xs[:threshold]
+    secrettables = [_gf256_multable(weight) for weight in _lagrange_weights(usedxs, 0)]
+    checktables = []
+    for x in xs[threshold:]:
+        checktables.append([_gf256_multable(weight) for weight in _lagrange_weights(usedxs, x)])
+
+    while True:
+        chunks = [_read_fully(instream, chunksize) for instream in instreams]
+
+        if any(len(chunk) != len(chunks[0]) for chunk in chunks):
+            raise ValueError("Shares have different lengths!")
+        if not chunks[0]:
+            break
+
+        for tables, chunk in zip(checktables, chunks[threshold:]):
+            if _weighted_sum(tables, chunks) != chunk:
+                raise ValueError("Shares do not match.   Cannot decode")
+
+        outstream.write(_weighted_sum(secrettables, chunks))
+
+
+def _f_chunk(multable, coefficients):
+    """
+    Like _f, but for every byte position of the (equal length) coefficient
+    strings at once.   multable is _gf256_multable(x).
+    """
+    # f(x) = a + x(b + x(c + ...))
+    result = coefficients[-1]
+    for coefficient in reversed(coefficients[:-1]):
+        result = _xor_bytes(result.translate(multable), coefficient)
+    return result
+
+
+def _read_fully(stream, size):
+    # pipes and sockets may return less than asked for before the end
+    data = b''
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += bytes(more)
+    return data
+
+
+def _lagrange_weights(xs, point):
+    """
+    Returns l_i(point) for each of the Lagrange basis polynomials of xs, so
+    the polynomial at point is the sum of l_i(point) * f(x_i).
+    """
+    weights = []
+    for i in range(len(xs)):
+        weight = 1
+        for j in range(len(xs)):
+            if i == j:
+                continue
+            weight = _gf256_mul(weight, _gf256_div(_gf256_sub(point, xs[j]),
+                                                   _gf256_sub(xs[i], xs[j])))
+        weights.append(weight)
+    return weights
+
+
+def _weighted_sum(tables, chunks):
+    # sum of table_i[chunk_i] over the tables (the chunks may be longer)
+    result = chunks[0].translate(tables[0])
+    for table, chunk in zip(tables[1:], chunks[1:]):
+        result = _xor_bytes(result, chunk.translate(table))
+    return result
+
+
 ### Private math helpers... Lagrange interpolation, polynomial math, etc.
 
 # This actually computes f(x).  It's private and not needed elsewhere...
@@ -388,6 +519,18 @@ def _gf256_mul(a, b):
     return _GF256_EXP[(_GF256_LOG[a] + _GF256_LOG[b]) % 255]
 
 
+def _gf256_multable(x):
+    # maps every byte b to b * x, for use with bytes.translate
+    return bytes(bytearray([_gf256_mul(b, x) for b in range(256)]))
+
+
+def _xor_bytes(a, b):
+    # XOR two equal length byte strings a whole string at a time
+    if PY3:
+        return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+    return bytes(bytearray([x ^ y for x, y in zip(bytearray(a), bytearray(b))]))
+
+
 def _gf256_div(a, b):
     if a == 0:
         return 0
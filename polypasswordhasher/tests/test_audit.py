@@ -0,0 +1,85 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.audit import audit_store, audit_password_file
+from polypasswordhasher.migrate import append_record
+from polypasswordhasher.pph import iter_entries, iter_password_file
+
+
+def _make_pph():
+    pph = PolyPasswordHasher(threshold=4, passwordfile=None, partialbytes=2)
+    pph.create_account('admin', 'correct horse', 3)
+    pph.create_account('root', 'battery staple', 2)
+    pph.create_account('alice', 'kitten', 1)
+    pph.create_account('bob', 'puppy', 1)
+    pph.create_account('dennis', 'menace', 0)
+    pph.create_account('eve', 'iamevil', 0)
+
+    # leave a hole in the shares
+    del pph.accountdict['alice']
+    return pph
+
+
+def _entry_key(item):
+    return item[0], item[1]['sharenumber'], item[1]['salt']
+
+
+def test_iteration():
+    pph = _make_pph()
+    assert sorted(username for username, entries in pph.iter_accounts()) == ['admin', 'bob', 'dennis', 'eve', 'root']
+    assert len(list(pph.iter_entries())) == 3 + 2 + 1 + 1 + 1
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'securepasswords')
+        pph.write_password_data(passwordfile)
+        fromfile = list(iter_entries(iter_password_file(passwordfile)))
+        assert sorted(fromfile, key=_entry_key) == sorted(pph.iter_entries(), key=_entry_key)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_audit():
+    pph = _make_pph()
+    report = audit_store(pph)
+
+    assert report['accounts'] == 5
+    assert report['entries'] == 8
+    assert report['thresholdaccounts'] == 3
+    assert report['thresholdlessaccounts'] == 2
+    assert report['sharesperaccount'] == {0: 2, 1: 1, 2: 1, 3: 1}
+    assert report['sharemap'] == {1: 'admin', 2: 'admin', 3: 'admin', 4: 'root', 5: 'root', 7: 'bob'}
+    assert report['maxshare'] == 7
+    assert report['gaps'] == [6]
+    assert report['duplicateshares'] == {}
+    assert report['algorithms'] == {'sha256': 8}
+    assert report['partialbytes'] == {2: 8}
+
+    # the same from a file holding a single dict...
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'securepasswords')
+        pph.write_password_data(passwordfile)
+        assert audit_password_file(passwordfile) == report
+        with open(passwordfile, 'rb') as infile:
+            assert pickle.load(infile) == pph.accountdict
+
+        # ...or from a record stream, read a record at a time
+        pph.write_password_data(passwordfile, records=True)
+        assert audit_password_file(passwordfile) == report
+        with open(passwordfile, 'rb') as infile:
+            assert isinstance(pickle.load(infile), tuple)
+
+        with open(passwordfile, 'wb') as outfile:
+            for username, entries in pph.iter_accounts():
+                append_record(outfile, username, entries)
+        assert audit_password_file(passwordfile) == report
+    finally:
+        shutil.rmtree(tempdir)
+
+    # a copied share shows up
+    pph.accountdict['mallory'] = [pph.accountdict['bob'][0]]
+    assert audit_store(pph)['duplicateshares'] == {7: ['bob', 'mallory']}
@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.coordinator import (UnlockCoordinator, UnlockNode, LocalTransport,
+                                            SocketTransport, serve_coordinator, _sign,
+                                            _encode_shares)
+
+THRESHOLD = 6
+NODEKEYS = {'node1': b'key one', 'node2': b'key two', 'node3': b'key three'}
+
+
+def _make_nodes(transport, partialbytes=2):
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'securepasswords')
+        pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=partialbytes)
+        pph.create_account('admin', 'correct horse', 4)
+        pph.create_account('root', 'battery staple', 4)
+        pph.create_account('carol', 'cheshire', 2)
+        pph.create_account('alice', 'kitten', 1)
+        pph.create_account('dennis', 'menace', 0)
+        pph.write_password_data(passwordfile)
+
+        nodes = []
+        for node in sorted(NODEKEYS):
+            nodepph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=passwordfile,
+                                         partialbytes=partialbytes)
+            nodes.append(UnlockNode(nodepph, node, NODEKEYS[node], transport))
+        return nodes
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def _unlock_fleet(coordinator, transport):
+    node1, node2, node3 = _make_nodes(transport)
+
+    # one admin isn't enough...
+    assert not node1.submit([('admin', 'correct horse')])
+    assert not node2.poll()
+    assert not coordinator.is_unlocked()
+
+    # ...a second one, on another node, is.
+    assert node2.submit([('root', 'battery staple')])
+    assert coordinator.is_unlocked()
+
+    # the others just ask
+    assert node1.poll()
+    assert node3.poll()
+
+    for node in [node1, node2, node3]:
+        assert node.pph.is_valid_login('alice', 'kitten')
+        assert node.pph.is_valid_login('dennis', 'menace')
+        assert not node.pph.is_valid_login('alice', 'nyancat!')
+        node.pph.create_account('moe', 'tadpole', 1)
+
+
+def test_local():
+    coordinator = UnlockCoordinator(THRESHOLD, NODEKEYS)
+    _unlock_fleet(coordinator, LocalTransport(coordinator))
+
+
+def test_socket():
+    coordinator = UnlockCoordinator(THRESHOLD, NODEKEYS)
+    server = serve_coordinator(coordinator, ('127.0.0.1', 0))
+    try:
+        _unlock_fleet(coordinator, SocketTransport(server.server_address))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_rejects():
+    coordinator = UnlockCoordinator(THRESHOLD, NODEKEYS)
+    transport = LocalTransport(coordinator)
+    node1, node2, node3 = _make_nodes(transport)
+
+    # a wrong password gives bad shares, which don't agree with the rest...
+    assert not node1.submit([('admin', 'correct horse')])
+    try:
+        node2.submit([('root', 'wrong staple')])
+    except ValueError:
+        pass
+    else:
+        assert False, "bad shares were accepted"
+
+    # ...until it is typed again
+    assert node2.submit([('root', 'battery staple')])
+
+    # nodes have to know their key...
+    impostor = UnlockNode(node3.pph, 'node3', b'guessed', transport)
+    try:
+        impostor.poll()
+    except ValueError:
+        pass
+    else:
+        assert False, "impostor was answered"
+    assert not node3.pph.knownsecret
+
+    # ...and can't replay old requests.
+    message = {'node': 'node1', 'action': 'collect', 'nonce': 'abc'}
+    assert coordinator.handle(_sign(b'key one', message))['status'] == 'unlocked'
+    assert coordinator.handle(_sign(b'key one', message))['status'] == 'error'
+
+
+def test_exactly_threshold():
+    coordinator = UnlockCoordinator(THRESHOLD, NODEKEYS)
+    transport = LocalTransport(coordinator)
+    node1, node2, node3 = _make_nodes(transport)
+
+    # admin's 4 shares and carol's 2 are just enough
+    assert not node1.submit([('admin', 'correct horse')])
+    assert node2.submit([('carol', 'cheshire')])
+    for node in [node1, node2, node3]:
+        assert node.poll()
+        assert node.pph.is_valid_login('alice', 'kitten')
+
+
+def _submit_unchecked(node, logindata):
+    # what a node without partial verification would send
+    shares = node.pph.compute_unlock_shares(logindata)
+    return node._request('submit', shares=_encode_shares(shares))
+
+
+def test_mistyped():
+    coordinator = UnlockCoordinator(THRESHOLD, NODEKEYS)
+    transport = LocalTransport(coordinator)
+    node1, node2, node3 = _make_nodes(transport)
+
+    # a password that doesn't match the partial bytes is never submitted
+    try:
+        node1.submit([('admin', 'wrong horse')])
+    except ValueError:
+        pass
+    else:
+        assert False, "a mistyped password was submitted"
+    assert not coordinator._submissions
+
+    # exactly threshold shares with a typo decode to a garbage secret, which
+    # the nodes refuse...
+    assert not _submit_unchecked(node1, [('admin', 'wrong horse')])
+    for node, unlock in [(node2, lambda: node2.submit([('carol', 'cheshire')])),
+                         (node1, node1.poll), (node3, node3.poll)]:
+        try:
+            unlock()
+        except ValueError:
+            pass
+        else:
+            assert False, "unlocked with a garbage secret"
+        assert not node.pph.knownsecret
+    assert coordinator.is_unlocked()
+
+    # ...so it is reset, and with more shares the odd node out is dropped
+    coordinator.reset()
+    assert not _submit_unchecked(node1, [('admin', 'wrong horse')])
+    try:
+        node2.submit([('root', 'battery staple')])
+    except ValueError:
+        pass
+    else:
+        assert False, "shares that don't agree were accepted"
+    assert node3.submit([('admin', 'correct horse')])
+
+    # every node gets the right secret, even the one with the typo
+    for node in [node1, node2, node3]:
+        assert node.poll()
+        assert node.pph.is_valid_login('alice', 'kitten')
+
+    # reset starts over
+    coordinator.reset()
+    assert not coordinator.is_unlocked()
+    node4 = _make_nodes(transport)[0]
+    assert not node4.submit([('admin', 'correct horse')])
+    assert not node4.poll()
+
+
+class _ForgedTransport(object):
+    # answers every request with shares of some other secret
+    def __init__(self, nodekey):
+        self.nodekey = nodekey
+        self.other = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None)
+
+    def request(self, message):
+        shares = [self.other.shamirsecretobj.compute_share(sharenumber)
+                  for sharenumber in range(1, THRESHOLD + 1)]
+        return _sign(self.nodekey, {'status': 'unlocked', 'nonce': message['nonce'],
+                                    'shares': _encode_shares(shares)})
+
+
+def test_checks_secret():
+    for partialbytes, logindata in [(2, []), (0, [('admin', 'correct horse')])]:
+        node = _make_nodes(None, partialbytes)[0]
+        node.transport = _ForgedTransport(NODEKEYS[node.node])
+        try:
+            if logindata:
+                node.submit(logindata)
+            else:
+                node.poll()
+        except ValueError:
+            pass
+        else:
+            assert False, "unlocked with shares that weren't checked"
+        assert not node.pph.knownsecret
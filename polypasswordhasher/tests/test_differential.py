@@ -0,0 +1,49 @@
+from polypasswordhasher import differential
+from polypasswordhasher.pph import do_bytearray_xor
+
+
+def test_backends_agree():
+    assert differential.run(iterations=200, seed=0) == []
+
+
+def test_finds_and_minimizes():
+    # an 'optimized' XOR that gets long inputs wrong
+    def badxor(a, b):
+        result = do_bytearray_xor(a, b)
+        if len(result) > 5:
+            result[3] ^= 1
+        return result
+
+    differential.register_backend('xor', 'bad', badxor)
+    try:
+        divergences = differential.run(iterations=50, seed=1, operations=['xor'])
+    finally:
+        del differential.BACKENDS['xor']['bad']
+
+    assert len(divergences) == 1
+    divergence = divergences[0]
+    assert divergence.backend == 'bad'
+
+    # shrunk down to the shortest failing input, all zeroes
+    assert divergence.args == [bytearray(6), bytearray(6)]
+    assert divergence.expected == ('returned', bytes(6))
+    assert 'xor' in repr(divergence)
+
+
+def test_catches_exceptions():
+    def fragile(x, coefs_bytes):
+        if len(coefs_bytes) > 3:
+            raise IndexError
+        return differential._f_reference(x, coefs_bytes)
+
+    differential.register_backend('f', 'fragile', fragile)
+    try:
+        divergences = differential.run(iterations=50, seed=2, operations=['f'])
+    finally:
+        del differential.BACKENDS['f']['fragile']
+
+    assert len(divergences) == 1
+    # the smallest valid x (0 isn't one) with the fewest coefficients that fail
+    assert divergences[0].args == [1, bytearray(4)]
+    assert divergences[0].expected == ('returned', 0)
+    assert divergences[0].got == ('raised', 'IndexError')
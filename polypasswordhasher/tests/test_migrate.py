@@ -0,0 +1,132 @@
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.migrate import read_credentials, migrate_accounts, repair_password_file
+
+THRESHOLD = 4
+
+ADMINS = [('admin', 'correct horse', 2), ('root', 'battery staple', 2)]
+USERS = [('user{0}'.format(i), 'password{0}'.format(i), i % 2) for i in range(40)]
+
+
+def _write_csv(path):
+    with open(path, 'w') as outfile:
+        outfile.write('username,password,shares\n')
+        for username, password, shares in ADMINS + USERS:
+            outfile.write('{0},{1},{2}\n'.format(username, password, shares))
+
+
+def _check_migrated(passwordfile):
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=passwordfile)
+    assert len(pph.accountdict) == len(ADMINS) + len(USERS)
+
+    pph.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+
+    for username, password, shares in USERS:
+        assert pph.is_valid_login(username, password)
+        assert not pph.is_valid_login(username, 'wrong')
+        assert len(pph.accountdict[username]) == max(shares, 1)
+
+    # the share counter picks up after the migrated accounts
+    pph.create_account('newbie', 'fresh', 1)
+    assert pph.accountdict['newbie'][0]['sharenumber'] == 2 * 2 + 20 + 1
+
+
+def test_read_credentials():
+    tempdir = tempfile.mkdtemp()
+    try:
+        csvfile = os.path.join(tempdir, 'dump.csv')
+        _write_csv(csvfile)
+        assert list(read_credentials(csvfile)) == ADMINS + USERS
+
+        jsonfile = os.path.join(tempdir, 'dump.jsonl')
+        with open(jsonfile, 'w') as outfile:
+            for username, password, shares in ADMINS:
+                outfile.write(json.dumps({'username': username, 'password': password, 'shares': shares}) + '\n')
+        assert list(read_credentials(jsonfile)) == ADMINS
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_migrate():
+    tempdir = tempfile.mkdtemp()
+    try:
+        csvfile = os.path.join(tempdir, 'dump.csv')
+        passwordfile = os.path.join(tempdir, 'migrated')
+        _write_csv(csvfile)
+
+        pph = PolyPasswordHasher(threshold=THRESHOLD)
+        count = migrate_accounts(pph, read_credentials(csvfile), passwordfile, chunksize=7, processes=2)
+
+        assert count == len(ADMINS) + len(USERS)
+        # nothing was kept in memory
+        assert pph.accountdict == {}
+        _check_migrated(passwordfile)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_resume():
+    tempdir = tempfile.mkdtemp()
+    try:
+        csvfile = os.path.join(tempdir, 'dump.csv')
+        passwordfile = os.path.join(tempdir, 'migrated')
+        _write_csv(csvfile)
+
+        pph = PolyPasswordHasher(threshold=THRESHOLD)
+        migrate_accounts(pph, itertools.islice(read_credentials(csvfile), 12), passwordfile, chunksize=5, processes=1)
+
+        # simulate a crash in the middle of writing a record
+        with open(passwordfile, 'ab') as outfile:
+            outfile.write(b'\x80\x02(X\x05\x00\x00\x00use')
+
+        assert repair_password_file(passwordfile) == 12
+
+        # a store with another secret can't carry on with it
+        try:
+            migrate_accounts(PolyPasswordHasher(threshold=THRESHOLD), read_credentials(csvfile),
+                             passwordfile, chunksize=5, processes=1)
+        except ValueError:
+            pass
+        else:
+            assert False, "resumed with another secret"
+        assert repair_password_file(passwordfile) == 12
+
+        # a new process loads what made it to disk and unlocks it...
+        pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=passwordfile)
+        pph.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+
+        # ...and finishes the job.   What was done is found by username, so
+        # the order doesn't have to match.
+        credentials = list(read_credentials(csvfile))
+        credentials.reverse()
+        count = migrate_accounts(pph, credentials, passwordfile, chunksize=5, processes=1)
+        assert count == len(ADMINS) + len(USERS)
+        _check_migrated(passwordfile)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_duplicates():
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'migrated')
+        credentials = ADMINS + [('bob', 'puppy', 1), ('carol', 'kitten', 0), ('bob', 'other', 1)]
+
+        pph = PolyPasswordHasher(threshold=THRESHOLD)
+        try:
+            migrate_accounts(pph, credentials, passwordfile, chunksize=2, processes=1)
+        except ValueError:
+            pass
+        else:
+            assert False, "migrated a duplicate username"
+
+        # the first bob made it and nobody else was written twice
+        pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=passwordfile)
+        assert sorted(pph.accountdict) == ['admin', 'bob', 'carol', 'root']
+    finally:
+        shutil.rmtree(tempdir)
@@ -1,3 +1,6 @@
+import os
+import pickle
+
 from polypasswordhasher import PolyPasswordHasher
 
 THRESHOLD = 10
@@ -123,3 +126,238 @@ def test_3_partial():
     # including create accounts...
     pph.create_account('moe', 'tadpole', 1)
     pph.create_account('larry', 'fish', 0)
+
+
+def test_4_upgrade():
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=2)
+
+    pph.create_account('admin', 'correct horse', THRESHOLD / 2)
+    pph.create_account('root', 'battery staple', THRESHOLD / 2)
+    pph.create_account('alice', 'kitten', 1)
+    pph.create_account('dennis', 'menace', 0)
+
+    # pretend these were written before entries carried an algorithm
+    for entry in pph.accountdict['alice'] + pph.accountdict['dennis']:
+        del entry['algorithm']
+        del entry['params']
+    assert pph.is_valid_login('alice', 'kitten')
+    assert pph.is_valid_login('dennis', 'menace')
+
+    # an upgrade never replaces entries other than the ones checked (they
+    # could hold a new password by now)
+    checked = pph.accountdict['dennis']
+    pph.accountdict['dennis'] = list(checked)
+    assert pph._upgrade_account('dennis', checked, b'menace') is None
+    assert 'algorithm' not in pph.accountdict['dennis'][0]
+
+    # switch to a stronger hash.   Old entries still verify as they are...
+    pph.algorithm = 'pbkdf2_sha256'
+    pph.algorithmparams = {'iterations': 1000}
+    assert pph.is_valid_login('admin', 'correct horse')
+    assert pph.accountdict['admin'][0]['algorithm'] == 'sha256'
+
+    # ...until they are upgraded by a successful login.
+    pph.upgradeonlogin = True
+    assert not pph.is_valid_login('alice', 'nyancat!')
+    assert 'algorithm' not in pph.accountdict['alice'][0]
+    for username, password in [('admin', 'correct horse'), ('alice', 'kitten'), ('dennis', 'menace')]:
+        assert pph.is_valid_login(username, password)
+        for entry in pph.accountdict[username]:
+            assert entry['algorithm'] == 'pbkdf2_sha256'
+            assert entry['params'] == {'iterations': 1000}
+        assert pph.is_valid_login(username, password)
+        assert not pph.is_valid_login(username, 'wrong')
+
+    pph.write_password_data(PASSWORDFILE)
+
+    # mixed entries decode fine after reloading
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE, partialbytes=2)
+    assert pph.is_valid_login('alice', 'kitten')
+    assert not pph.is_valid_login('alice', 'nyancat!')
+    pph.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    assert pph.is_valid_login('dennis', 'menace')
+    assert pph.accountdict['admin'][0]['sharenumber'] == 1
+
+
+def test_5_delta():
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None)
+    pph.create_account('admin', 'correct horse', THRESHOLD / 2)
+    pph.create_account('root', 'battery staple', THRESHOLD / 2)
+    pph.create_account('alice', 'kitten', 1)
+    pph.write_password_data(PASSWORDFILE)
+
+    # both start from the same file
+    primary = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE)
+    primary.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    standby = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE)
+    standby.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+
+    primary.create_account('bob', 'puppy', 1)
+    primary.create_account('dennis', 'menace', 0)
+
+    # the standby hasn't synced with this primary yet...
+    try:
+        standby.apply_delta(primary.export_delta(since=0))
+    except ValueError:
+        pass
+    else:
+        assert False, "applied a delta from another epoch"
+
+    # ...so it gets everything, through a pipe
+    readfd, writefd = os.pipe()
+    with os.fdopen(writefd, 'wb') as outfile:
+        primary.write_delta(outfile)
+    with os.fdopen(readfd, 'rb') as infile:
+        standby.read_delta(infile)
+    written = primary.changesequence
+
+    assert standby.is_valid_login('bob', 'puppy')
+    assert standby.is_valid_login('dennis', 'menace')
+    assert not standby.is_valid_login('bob', 'kitten')
+    assert standby.nextavailableshare == primary.nextavailableshare
+    assert standby.changesequence == primary.changesequence
+
+    # only the changes are sent
+    primary.upgradeonlogin = True
+    primary.algorithm = 'pbkdf2_sha256'
+    primary.algorithmparams = {'iterations': 1000}
+    assert primary.is_valid_login('alice', 'kitten')
+    delta = primary.export_delta(since=standby.changesequence)
+    assert [username for sequence, username, entries in delta['accounts']] == ['alice']
+    standby.apply_delta(delta)
+    assert standby.is_valid_login('alice', 'kitten')
+
+    # a standby can't skip changes...
+    primary.create_account('charlie', 'velociraptor', 1)
+    primary.create_account('eve', 'iamevil', 0)
+    try:
+        standby.apply_delta(primary.export_delta(since=primary.changesequence - 1))
+    except ValueError:
+        pass
+    else:
+        assert False, "applied a delta with a gap"
+
+    # ...but replaying ones it has seen is harmless
+    standby.apply_delta(primary.export_delta(since=written))
+    assert standby.accountdict['alice'][0]['algorithm'] == 'pbkdf2_sha256'
+    assert standby.is_valid_login('charlie', 'velociraptor')
+    assert standby.is_valid_login('eve', 'iamevil')
+
+    # a restarted primary numbers its changes from 0 again, so its deltas
+    # aren't mixed up with the old ones
+    primary.write_password_data(PASSWORDFILE)
+    primary = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE)
+    primary.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    primary.create_account('fred', 'flintstone', 0)
+    try:
+        standby.apply_delta(primary.export_delta(since=0))
+    except ValueError:
+        pass
+    else:
+        assert False, "applied a delta from a restarted primary"
+    standby.apply_delta(primary.export_delta())
+    assert standby.is_valid_login('fred', 'flintstone')
+
+    # and whatever comes down the pipe is only ever data
+    readfd, writefd = os.pipe()
+    with os.fdopen(writefd, 'wb') as outfile:
+        outfile.write(pickle.dumps(primary.export_delta()) + b'\n')
+    with os.fdopen(readfd, 'rb') as infile:
+        try:
+            standby.read_delta(infile)
+        except ValueError:
+            pass
+        else:
+            assert False, "read a pickled delta"
+
+
+def test_6_reload():
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=2)
+    pph.create_account('admin', 'correct horse', THRESHOLD / 2)
+    pph.create_account('root', 'battery staple', THRESHOLD / 2)
+    pph.create_account('alice', 'kitten', 1)
+    pph.create_account('bob', 'puppy', 1)
+    pph.write_password_data(PASSWORDFILE)
+
+    running = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE, partialbytes=2)
+    running.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    standby = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE, partialbytes=2)
+    standby.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    standby.apply_delta(running.export_delta())
+    synced = running.changesequence
+
+    # accounts are changed elsewhere...
+    del pph.accountdict['bob']
+    pph.create_account('charlie', 'velociraptor', 1)
+    pph.create_account('dennis', 'menace', 0)
+    pph.write_password_data(PASSWORDFILE)
+
+    # ...and picked up without locking
+    running.reload_password_data(PASSWORDFILE, background=True).result()
+
+    assert running.knownsecret
+    assert running.is_valid_login('charlie', 'velociraptor')
+    assert running.is_valid_login('dennis', 'menace')
+    assert running.is_valid_login('alice', 'kitten')
+    assert 'bob' not in running.accountdict
+    assert running.nextavailableshare == pph.nextavailableshare
+
+    # standbys get the changes, removal included
+    standby.apply_delta(running.export_delta(since=synced))
+    assert sorted(standby.accountdict) == sorted(running.accountdict)
+    assert standby.is_valid_login('charlie', 'velociraptor')
+    assert standby.is_valid_login('dennis', 'menace')
+    assert standby.is_valid_login('alice', 'kitten')
+    assert not standby.is_valid_login('charlie', 'kitten')
+    try:
+        standby.is_valid_login('bob', 'puppy')
+    except ValueError:
+        pass
+    else:
+        assert False, "removed account still logs in"
+
+    # a file from another store doesn't decode with this secret
+    other = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=2)
+    other.create_account('admin', 'correct horse', THRESHOLD)
+    other.write_password_data(PASSWORDFILE)
+    try:
+        running.reload_password_data(PASSWORDFILE)
+    except ValueError:
+        pass
+    else:
+        assert False, "reloaded a file with another secret"
+    assert running.is_valid_login('charlie', 'velociraptor')
+
+    # without partial verification, nothing can be checked
+    unchecked = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None)
+    unchecked.create_account('admin', 'correct horse', THRESHOLD)
+    unchecked.write_password_data(PASSWORDFILE)
+    try:
+        unchecked.reload_password_data(PASSWORDFILE)
+    except ValueError:
+        pass
+    else:
+        assert False, "reloaded a file without checking it"
+    unchecked.reload_password_data(PASSWORDFILE, unchecked=True)
+    assert unchecked.is_valid_login('admin', 'correct horse')
+
+
+def test_7_snapshot():
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None)
+    pph.create_account('admin', 'correct horse', THRESHOLD / 2)
+    pph.create_account('root', 'battery staple', THRESHOLD / 2)
+    pph.create_account('alice', 'kitten', 1)
+
+    future = pph.write_password_data_async(PASSWORDFILE)
+
+    # changes after the call aren't in the snapshot
+    pph.create_account('bob', 'puppy', 1)
+    assert future.result() == 3
+
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=PASSWORDFILE)
+    assert sorted(pph.accountdict) == ['admin', 'alice', 'root']
+    pph.unlock_password_data([('admin', 'correct horse'), ('root', 'battery staple')])
+    assert pph.is_valid_login('alice', 'kitten')
+
+    # nothing is left lying around
+    assert not [name for name in os.listdir('.') if name.startswith('.' + PASSWORDFILE)]
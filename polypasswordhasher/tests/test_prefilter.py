@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.prefilter import export_prefilter, PrefilterVerifier
+
+ACCOUNTS = [('admin', 'correct horse', 2), ('root', 'battery staple', 2),
+            ('alice', 'kitten', 1), ('bob', 'puppy', 1), ('dennis', 'menace', 0)]
+
+
+def test_prefilter():
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'securepasswords')
+        prefilterfile = os.path.join(tempdir, 'prefilter')
+
+        pph = PolyPasswordHasher(threshold=4, passwordfile=None, partialbytes=4)
+        for username, password, shares in ACCOUNTS[:3]:
+            pph.create_account(username, password, shares)
+        pph.algorithm = 'pbkdf2_sha256'
+        pph.algorithmparams = {'iterations': 1000}
+        for username, password, shares in ACCOUNTS[3:]:
+            pph.create_account(username, password, shares)
+        pph.write_password_data(passwordfile)
+
+        # exported from a locked store
+        locked = PolyPasswordHasher(threshold=4, passwordfile=passwordfile, partialbytes=4)
+        export_prefilter(locked, prefilterfile)
+        # no temporary file is left behind
+        assert sorted(os.listdir(tempdir)) == ['prefilter', 'securepasswords']
+
+        verifier = PrefilterVerifier(prefilterfile)
+        try:
+            assert len(verifier) == len(ACCOUNTS)
+            assert len(verifier.algorithms) == 2
+
+            for username, password, shares in ACCOUNTS:
+                assert verifier.is_plausible_login(username, password)
+                assert locked.is_valid_login(username, password)
+                assert not verifier.is_plausible_login(username, password + '!')
+                assert not locked.is_valid_login(username, password + '!')
+
+            assert not verifier.is_plausible_login('mallory', 'kitten')
+        finally:
+            verifier.close()
+
+        # without partial verification there is nothing to export
+        try:
+            export_prefilter(PolyPasswordHasher(threshold=4), prefilterfile)
+        except ValueError:
+            pass
+        else:
+            assert False, "exported a prefilter without partial bytes"
+    finally:
+        shutil.rmtree(tempdir)
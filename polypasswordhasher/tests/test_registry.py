@@ -0,0 +1,184 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher import registry as registrymodule
+from polypasswordhasher.registry import PasswordStoreRegistry
+
+THRESHOLD = 4
+TENANTS = ['acme', 'globex', 'initech', 'umbrella']
+ADMINS = [('admin', 'correct horse'), ('root', 'battery staple')]
+
+
+def _make_directory():
+    directory = tempfile.mkdtemp()
+    for tenant in TENANTS:
+        pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None)
+        pph.create_account('admin', 'correct horse', 2)
+        pph.create_account('root', 'battery staple', 2)
+        pph.create_account('alice', tenant, 1)
+        pph.write_password_data(os.path.join(directory, tenant))
+    return directory
+
+
+def test_lru():
+    directory = _make_directory()
+    try:
+        registry = PasswordStoreRegistry(THRESHOLD, directory, maxloaded=2, keepunlocked=True)
+
+        registry.get('acme').unlock_password_data(ADMINS)
+        registry.get('acme').create_account('bob', 'puppy', 1)
+        registry.get('globex')
+        registry.get('initech')
+
+        # acme was unloaded (and written)...
+        stats = registry.stats()
+        assert stats['loaded'] == 2
+        assert stats['unloads'] == 1
+        assert stats['writes'] == 1
+        assert stats['keptsecrets'] == 1
+        assert stats['hits'] == 1
+
+        # ...but comes back unlocked, with the new account.
+        acme = registry.get('acme')
+        assert acme.knownsecret
+        assert acme.is_valid_login('alice', 'acme')
+        assert acme.is_valid_login('bob', 'puppy')
+        acme.create_account('charlie', 'velociraptor', 1)
+
+        # locked stores stay locked
+        assert not registry.get('globex').knownsecret
+
+        registry.unload_idle(0)
+        assert registry.stats()['loaded'] == 0
+        assert registry.get('acme').is_valid_login('charlie', 'velociraptor')
+
+        # without keepunlocked, nothing is kept
+        registry = PasswordStoreRegistry(THRESHOLD, directory, maxloaded=1)
+        registry.get('umbrella').unlock_password_data(ADMINS)
+        registry.get('acme')
+        assert not registry.get('umbrella').knownsecret
+        assert registry.stats()['keptsecrets'] == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_create():
+    directory = _make_directory()
+    try:
+        registry = PasswordStoreRegistry(THRESHOLD, directory, maxloaded=1)
+
+        try:
+            registry.get('../etc')
+        except ValueError:
+            pass
+        else:
+            assert False, "loaded a file outside the directory"
+
+        hooli = registry.create('hooli')
+
+        # can't be written without enough shares, so it stays loaded
+        registry.get('acme')
+        assert registry.stats()['loaded'] == 2
+
+        hooli.create_account('admin', 'correct horse', 4)
+        registry.get('globex')
+        assert registry.stats()['loaded'] == 1
+
+        hooli = registry.get('hooli')
+        hooli.unlock_password_data([('admin', 'correct horse')])
+        assert hooli.is_valid_login('admin', 'correct horse')
+
+        registry.close()
+        assert registry.stats()['loaded'] == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_lease():
+    directory = _make_directory()
+    try:
+        registry = PasswordStoreRegistry(THRESHOLD, directory, maxloaded=1)
+
+        # a store that was unloaded refuses changes rather than losing them...
+        acme = registry.get('acme')
+        acme.unlock_password_data(ADMINS)
+        registry.get('globex')
+        try:
+            acme.create_account('bob', 'puppy', 1)
+        except ValueError:
+            pass
+        else:
+            assert False, "changed an unloaded store"
+
+        # ...while a leased one stays loaded
+        with registry.lease('acme') as acme:
+            acme.unlock_password_data(ADMINS)
+            registry.get('globex')
+            registry.get('initech')
+            acme.create_account('bob', 'puppy', 1)
+            assert registry.stats()['leased'] == 1
+        assert registry.stats()['loaded'] == 1
+
+        acme = registry.get('acme')
+        acme.unlock_password_data(ADMINS)
+        assert acme.is_valid_login('bob', 'puppy')
+        assert acme.accountdict['bob'][0]['sharenumber'] == 6
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_slow_load():
+    directory = _make_directory()
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_pph(threshold, passwordfile, partialbytes):
+        if passwordfile.endswith('acme'):
+            loading.set()
+            release.wait(10)
+        return PolyPasswordHasher(threshold, passwordfile, partialbytes)
+
+    registrymodule.PolyPasswordHasher = slow_pph
+    try:
+        registry = PasswordStoreRegistry(THRESHOLD, directory, maxloaded=2)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get('acme')))
+                   for _ in range(2)]
+        threads[0].start()
+        assert loading.wait(10)
+        threads[1].start()
+
+        # other tenants don't wait for acme's file...
+        assert not registry.get('globex').knownsecret
+        assert registry.stats()['loaded'] == 1
+
+        # ...while acme is loaded once, for both
+        release.set()
+        for thread in threads:
+            thread.join()
+        assert results[0] is results[1]
+        assert registry.stats()['loads'] == 2
+    finally:
+        registrymodule.PolyPasswordHasher = PolyPasswordHasher
+        shutil.rmtree(directory)
+
+
+def test_migrate():
+    directory = _make_directory()
+    try:
+        registry = PasswordStoreRegistry(THRESHOLD, directory, keepunlocked=True, processes=2)
+        credentials = [('admin', 'correct horse', 2), ('root', 'battery staple', 2),
+                       ('alice', 'kitten', 1), ('dennis', 'menace', 0)]
+        assert registry.migrate('hooli', credentials, chunksize=3) == 4
+
+        # the store comes back unlocked since keepunlocked is set
+        hooli = registry.get('hooli')
+        assert hooli.knownsecret
+        assert hooli.is_valid_login('alice', 'kitten')
+        assert hooli.is_valid_login('dennis', 'menace')
+        registry.close()
+    finally:
+        shutil.rmtree(directory)
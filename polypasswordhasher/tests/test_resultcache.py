@@ -0,0 +1,154 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.resultcache import ResultCache
+
+THRESHOLD = 4
+
+ACCOUNTS = [('admin', 'correct horse', 2), ('root', 'battery staple', 2),
+            ('alice', 'kitten', 1), ('bob', 'puppy', 1), ('charlie', 'velociraptor', 1),
+            ('dennis', 'menace', 0), ('eve', 'iamevil', 0)]
+
+ADMINS = [('admin', 'correct horse'), ('root', 'battery staple')]
+
+
+def _make_pph(partialbytes=0):
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=partialbytes)
+    for username, password, shares in ACCOUNTS:
+        pph.create_account(username, password, shares)
+    return pph
+
+
+def _check_logins(pph):
+    for username, password, shares in ACCOUNTS:
+        assert pph.is_valid_login(username, password)
+        assert not pph.is_valid_login(username, password + '!')
+
+
+def test_cached_logins():
+    pph = _make_pph()
+    pph.resultcache = ResultCache()
+
+    # only the successful logins are kept...
+    _check_logins(pph)
+    assert len(pph.resultcache) == len(ACCOUNTS)
+    assert pph.resultcache.hits == 0
+
+    # ...and answer the repeats.
+    _check_logins(pph)
+    assert pph.resultcache.hits == len(ACCOUNTS)
+
+
+def test_ttl_and_size():
+    pph = _make_pph()
+    pph.resultcache = ResultCache(ttl=0)
+    assert pph.is_valid_login('alice', 'kitten')
+    assert pph.is_valid_login('alice', 'kitten')
+    assert pph.resultcache.hits == 0
+
+    pph.resultcache = ResultCache(maxsize=2)
+    _check_logins(pph)
+    assert len(pph.resultcache) == 2
+    assert pph.resultcache.evictions == len(ACCOUNTS) - 2
+
+    # the two most recent are the ones kept
+    assert pph.is_valid_login('eve', 'iamevil')
+    assert pph.is_valid_login('dennis', 'menace')
+    assert pph.resultcache.hits == 2
+    assert pph.is_valid_login('alice', 'kitten')
+    assert pph.resultcache.hits == 2
+
+
+def test_invalidation():
+    tempdir = tempfile.mkdtemp()
+    try:
+        passwordfile = os.path.join(tempdir, 'securepasswords')
+        pph = _make_pph()
+        pph.write_password_data(passwordfile)
+        primary = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=passwordfile)
+        primary.unlock_password_data(ADMINS)
+    finally:
+        shutil.rmtree(tempdir)
+
+    primary.apply_delta(pph.export_delta())
+    synced = pph.changesequence
+
+    primary.resultcache = ResultCache()
+    assert primary.is_valid_login('alice', 'kitten')
+    assert primary.is_valid_login('bob', 'puppy')
+
+    # alice's password is changed elsewhere and the change is applied here
+    del pph.accountdict['alice']
+    pph.create_account('alice', 'puppy', 0)
+    primary.apply_delta(pph.export_delta(since=synced))
+    assert len(primary.resultcache) == 1
+    assert not primary.is_valid_login('alice', 'kitten')
+    assert primary.is_valid_login('alice', 'puppy')
+    assert primary.resultcache.hits == 0
+
+    # bob didn't change
+    assert primary.is_valid_login('bob', 'puppy')
+    assert primary.resultcache.hits == 1
+
+
+def test_change_during_check():
+    pph = _make_pph()
+    pph.resultcache = ResultCache()
+    pph.create_account('newdennis', 'changed', 0)
+    newentries = pph.accountdict.pop('newdennis')
+
+    # pretend dennis was written before entries carried an algorithm, so the
+    # check goes through pph.hasher, which changes the password meanwhile
+    for entry in pph.accountdict['dennis']:
+        del entry['algorithm']
+        del entry['params']
+
+    def changing_hasher(data):
+        pph.accountdict['dennis'] = newentries
+        return hashlib.sha256(data)
+
+    pph.hasher = changing_hasher
+    assert pph.is_valid_login('dennis', 'menace')
+    pph.hasher = hashlib.sha256
+
+    # the old password was right when checked, but isn't remembered for the
+    # new entries
+    assert not pph.is_valid_login('dennis', 'menace')
+    assert pph.is_valid_login('dennis', 'changed')
+
+    # nor does removing the account during a check break it
+    for entry in pph.accountdict['eve']:
+        del entry['algorithm']
+        del entry['params']
+
+    def removing_hasher(data):
+        pph.accountdict.pop('eve', None)
+        return hashlib.sha256(data)
+
+    pph.hasher = removing_hasher
+    assert pph.is_valid_login('eve', 'iamevil')
+    assert 'eve' not in pph.accountdict
+
+
+def test_relock():
+    pph = _make_pph(2)
+    pph.resultcache = ResultCache()
+    assert pph.is_valid_login('dennis', 'menace')
+    shares = [pph.shamirsecretobj.compute_share(sharenumber) for sharenumber in range(1, THRESHOLD + 1)]
+
+    pph.lock_password_data()
+    assert len(pph.resultcache) == 0
+    assert not pph.knownsecret
+
+    # partial verification still works, without the cache...
+    assert pph.is_valid_login('dennis', 'menace')
+    assert len(pph.resultcache) == 0
+
+    # ...and unlocking again brings it back.
+    pph.unlock_with_shares(shares)
+    assert pph.is_valid_login('dennis', 'menace')
+    assert pph.is_valid_login('dennis', 'menace')
+    assert pph.resultcache.hits == 1
@@ -0,0 +1,164 @@
+import threading
+import time
+
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.scheduler import (VerificationScheduler, Overloaded, DeadlineExceeded,
+                                          PRIORITY_SHARES, PRIORITY_THRESHOLDLESS, PRIORITY_UNKNOWN)
+
+THRESHOLD = 4
+
+
+class GatedPolyPasswordHasher(PolyPasswordHasher):
+    """Holds every login until the gate opens and records the order."""
+
+    def __init__(self, *args, **kwargs):
+        PolyPasswordHasher.__init__(self, *args, **kwargs)
+        self.gate = threading.Event()
+        self.checked = []
+
+    def is_valid_login(self, username, password):
+        self.gate.wait()
+        self.checked.append(username)
+        return PolyPasswordHasher.is_valid_login(self, username, password)
+
+
+def _make_pph():
+    pph = GatedPolyPasswordHasher(threshold=THRESHOLD)
+    pph.create_account('admin', 'correct horse', 4)
+    pph.create_account('alice', 'kitten', 1)
+    pph.create_account('dennis', 'menace', 0)
+    return pph
+
+
+def test_priorities():
+    pph = _make_pph()
+    scheduler = VerificationScheduler(pph, workers=1, maxqueue=100)
+    try:
+        assert scheduler.priority('admin') == PRIORITY_SHARES
+        assert scheduler.priority('alice') == PRIORITY_SHARES
+        assert scheduler.priority('dennis') == PRIORITY_THRESHOLDLESS
+        assert scheduler.priority('mallory') == PRIORITY_UNKNOWN
+
+        # the worker is stuck on the first one while the rest queue up
+        first = scheduler.submit('dennis', 'menace')
+        while scheduler.stats()['queued']:
+            time.sleep(0.001)
+
+        guesses = [scheduler.submit('mallory', 'guess{0}'.format(i)) for i in range(5)]
+        thresholdless = scheduler.submit('dennis', 'wrong')
+        admin = scheduler.submit('admin', 'correct horse')
+        assert scheduler.stats()['queued'] == 7
+
+        pph.gate.set()
+        assert first.result()
+        assert admin.result()
+        assert not thresholdless.result()
+        for guess in guesses:
+            try:
+                guess.result()
+            except ValueError:
+                pass
+            else:
+                assert False, "unknown user was accepted"
+
+        assert pph.checked == ['dennis', 'admin', 'dennis'] + ['mallory'] * 5
+
+        stats = scheduler.stats()
+        assert stats['completed'] == 8
+        assert stats['maxqueued'] == 7
+        assert stats['latency'][PRIORITY_SHARES]['count'] == 1
+        assert stats['latency'][PRIORITY_UNKNOWN]['count'] == 5
+    finally:
+        pph.gate.set()
+        scheduler.close()
+
+
+def test_shedding_and_deadlines():
+    pph = _make_pph()
+    scheduler = VerificationScheduler(pph, workers=1, maxqueue=3)
+    try:
+        scheduler.submit('dennis', 'menace')
+        while scheduler.stats()['queued']:
+            time.sleep(0.001)
+
+        guesses = [scheduler.submit('mallory', 'guess{0}'.format(i)) for i in range(3)]
+
+        # a full queue turns away another guess...
+        try:
+            scheduler.submit('mallory', 'guess3').result()
+        except Overloaded:
+            pass
+        else:
+            assert False, "queue grew past maxqueue"
+
+        # ...but makes room for an admin by shedding the newest guess.
+        admin = scheduler.submit('admin', 'correct horse', timeout=60)
+        try:
+            guesses[2].result()
+        except Overloaded:
+            pass
+        else:
+            assert False, "nothing was shed"
+
+        # this one will be too old by the time it is looked at
+        late = scheduler.submit('alice', 'kitten', timeout=0)
+        assert scheduler.stats()['shed'] == 3
+
+        time.sleep(0.01)
+        pph.gate.set()
+        assert admin.result()
+        try:
+            late.result()
+        except DeadlineExceeded:
+            pass
+        else:
+            assert False, "deadline was ignored"
+        assert scheduler.stats()['expired'] == 1
+    finally:
+        pph.gate.set()
+        scheduler.close()
+
+    try:
+        scheduler.submit('alice', 'kitten')
+    except ValueError:
+        pass
+    else:
+        assert False, "closed scheduler took a request"
+
+
+def test_expired_make_room():
+    pph = _make_pph()
+    scheduler = VerificationScheduler(pph, workers=1, maxqueue=3)
+    try:
+        scheduler.submit('dennis', 'menace')
+        while scheduler.stats()['queued']:
+            time.sleep(0.001)
+
+        stale = [scheduler.submit('mallory', 'guess{0}'.format(i), timeout=0) for i in range(3)]
+        time.sleep(0.01)
+
+        # the queue only holds requests past their deadline, so a new one
+        # takes their place rather than being shed
+        fresh = scheduler.submit('mallory', 'guess3')
+        stats = scheduler.stats()
+        assert stats['queued'] == 1
+        assert stats['expired'] == 3
+        assert stats['shed'] == 0
+        for future in stale:
+            try:
+                future.result()
+            except DeadlineExceeded:
+                pass
+            else:
+                assert False, "expired request was checked"
+
+        pph.gate.set()
+        try:
+            fresh.result()
+        except ValueError:
+            pass
+        else:
+            assert False, "unknown user was accepted"
+    finally:
+        pph.gate.set()
+        scheduler.close()
@@ -1,9 +1,12 @@
-from polypasswordhasher.shamirsecret import ShamirSecret, _full_lagrange
+import io
+import os
+
+from polypasswordhasher.shamirsecret import ShamirSecret, _full_lagrange, _multiply_polynomials, split_stream, combine_streams
 
 
 def test_math():
-    # doesnt pass now w/ c implementation
-    #assert(_multiply_polynomials([1, 3, 4], [4, 5]) == [4, 9, 31, 20])
+    # the C implementation once disagreed here.   See test_differential.py
+    assert _multiply_polynomials([1, 3, 4], [4, 5]) == [4, 9, 31, 20]
     assert _full_lagrange([2, 4, 5], [14, 30, 32]) == [43, 168, 150]
 
 
@@ -89,3 +92,47 @@ def test_intro():
 
     # but not now...
     assert not newsecret.is_valid_share(d)
+
+
+def test_streams():
+    secret = os.urandom(10000)
+
+    outstreams = [io.BytesIO() for _ in range(5)]
+    split_stream(3, io.BytesIO(secret), outstreams, chunksize=999)
+    shares = [outstream.getvalue() for outstream in outstreams]
+
+    # each share is its x followed by one byte per byte of the secret
+    assert [bytearray(share)[0] for share in shares] == [1, 2, 3, 4, 5]
+    assert all(len(share) == len(secret) + 1 for share in shares)
+
+    # any three will do...
+    for indices in [(0, 1, 2), (4, 2, 0), (1, 3, 4)]:
+        recovered = io.BytesIO()
+        combine_streams(3, [io.BytesIO(shares[i]) for i in indices], recovered, chunksize=512)
+        assert recovered.getvalue() == secret
+
+    # ... and the bytes are ordinary shares of each byte of the secret.
+    t = ShamirSecret(3)
+    t.recover_secretdata([(bytearray(share)[0], bytearray(share[1:17])) for share in shares])
+    assert t.secretdata == secret[:16]
+
+    # extra shares are checked
+    recovered = io.BytesIO()
+    combine_streams(3, [io.BytesIO(share) for share in shares], recovered)
+    assert recovered.getvalue() == secret
+
+    tampered = bytearray(shares[4])
+    tampered[5000] ^= 1
+    try:
+        combine_streams(3, [io.BytesIO(share) for share in shares[:4]] + [io.BytesIO(bytes(tampered))], io.BytesIO())
+    except ValueError:
+        pass
+    else:
+        assert False, "tampered share was accepted"
+
+    try:
+        combine_streams(3, [io.BytesIO(share) for share in shares[:2]], io.BytesIO())
+    except ValueError:
+        pass
+    else:
+        assert False, "recovered with fewer than threshold shares"
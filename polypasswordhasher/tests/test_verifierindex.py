@@ -0,0 +1,100 @@
+from polypasswordhasher import PolyPasswordHasher
+from polypasswordhasher.verifierindex import VerifierIndex
+
+THRESHOLD = 4
+
+ACCOUNTS = [('admin', 'correct horse', 2), ('root', 'battery staple', 2),
+            ('alice', 'kitten', 1), ('bob', 'puppy', 1), ('charlie', 'velociraptor', 1),
+            ('dennis', 'menace', 0), ('eve', 'iamevil', 0)]
+
+
+def _make_pph(partialbytes=0):
+    pph = PolyPasswordHasher(threshold=THRESHOLD, passwordfile=None, partialbytes=partialbytes)
+    for username, password, shares in ACCOUNTS:
+        pph.create_account(username, password, shares)
+    return pph
+
+
+def _check_logins(pph):
+    for username, password, shares in ACCOUNTS:
+        assert pph.is_valid_login(username, password)
+        assert not pph.is_valid_login(username, password + '!')
+
+
+def test_same_answers():
+    for partialbytes in [0, 2]:
+        pph = _make_pph(partialbytes)
+        pph.verifierindex = VerifierIndex()
+
+        # filled on first login...
+        _check_logins(pph)
+        assert len(pph.verifierindex) == len(ACCOUNTS)
+        assert pph.verifierindex.misses == len(ACCOUNTS)
+
+        # ...and used after that.
+        _check_logins(pph)
+        assert pph.verifierindex.hits == 3 * len(ACCOUNTS)
+
+
+def test_budget():
+    pph = _make_pph()
+    pph.verifierindex = VerifierIndex(maxsize=3)
+    _check_logins(pph)
+    assert len(pph.verifierindex) == 3
+    assert pph.verifierindex.evictions == len(ACCOUNTS) - 3
+
+    pph.verifierindex.shrink(1)
+    assert len(pph.verifierindex) == 1
+    _check_logins(pph)
+
+
+def test_build_and_change():
+    pph = _make_pph()
+    pph.verifierindex = VerifierIndex()
+    pph.build_verifier_index(background=True).join()
+    assert len(pph.verifierindex) == len(ACCOUNTS)
+
+    _check_logins(pph)
+    assert pph.verifierindex.misses == 0
+
+    # a changed account isn't checked against its old digest
+    pph.algorithm = 'pbkdf2_sha256'
+    pph.algorithmparams = {'iterations': 1000}
+    pph.upgradeonlogin = True
+    assert pph.is_valid_login('alice', 'kitten')
+    assert pph.accountdict['alice'][0]['algorithm'] == 'pbkdf2_sha256'
+    assert pph.is_valid_login('alice', 'kitten')
+    assert not pph.is_valid_login('alice', 'puppy')
+
+    # even if it is replaced behind the index's back
+    assert pph.is_valid_login('bob', 'puppy')
+    pph.accountdict['bob'] = pph.accountdict['charlie']
+    assert pph.is_valid_login('bob', 'velociraptor')
+    assert not pph.is_valid_login('bob', 'puppy')
+
+
+def test_build_during_changes():
+    pph = _make_pph()
+    pph.verifierindex = VerifierIndex()
+    put = pph.verifierindex.put
+
+    # an account removed while the index is built is skipped...
+    def removing_put(username, entries, expected):
+        pph.accountdict.pop('eve', None)
+        put(username, entries, expected)
+
+    pph.verifierindex.put = removing_put
+    pph.build_verifier_index()
+    assert len(pph.verifierindex) == len(ACCOUNTS) - 1
+
+    # ...and locking stops the build
+    pph.verifierindex = VerifierIndex()
+    put = pph.verifierindex.put
+
+    def locking_put(username, entries, expected):
+        put(username, entries, expected)
+        pph.lock_password_data()
+
+    pph.verifierindex.put = locking_put
+    pph.build_verifier_index()
+    assert len(pph.verifierindex) == 0
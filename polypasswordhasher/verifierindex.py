@@ -0,0 +1,89 @@
+"""
+A size bounded index of what each account's salted hash should be.
+
+Once a password file is unlocked, the salted hash an entry expects is fixed:
+for a share it is the passhash XOR the share and for a thresholdless entry it
+is the decrypted passhash.   Keeping a keyed digest of it lets
+PolyPasswordHasher.is_valid_login check a threshold account with one hash
+and one comparison, just like a thresholdless one.
+
+Only a truncated HMAC of the expected hash (keyed by a random per-index key)
+is kept, never the hash itself.
+"""
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+
+
+class VerifierIndex(object):
+    """
+    Maps usernames to the digest of their expected salted hash, keeping at
+    most maxsize of the most recently used ones.
+    """
+
+    # bytes of the HMAC that are kept
+    digestsize = 16
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+
+        self._key = os.urandom(32)
+
+        # username -> (entries, digest), least recently used first.   The
+        # entries list is kept to spot a changed account.
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._digests)
+
+    def digest(self, saltedpasswordhash):
+        return hmac.new(self._key, bytes(saltedpasswordhash), hashlib.sha256).digest()[:self.digestsize]
+
+    def get(self, username, entries):
+        """
+        Returns the digest for username or None if it isn't indexed.   The
+        digest is only returned if it was computed from this very entries
+        list (accounts are changed by replacing their list).
+        """
+        with self._lock:
+            item = self._digests.pop(username, None)
+            if item is None or item[0] is not entries:
+                self.misses += 1
+                return None
+
+            # most recently used goes to the end
+            self._digests[username] = item
+            self.hits += 1
+            return item[1]
+
+    def put(self, username, entries, digest):
+        with self._lock:
+            self._digests.pop(username, None)
+            self._digests[username] = (entries, digest)
+            self._shrink(self.maxsize)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._digests.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._digests.clear()
+
+    def shrink(self, size):
+        """Evicts the least recently used accounts (say, under memory
+           pressure) until at most size are left."""
+        with self._lock:
+            self._shrink(size)
+
+    def _shrink(self, size):
+        while len(self._digests) > max(size, 0):
+            self._digests.popitem(last=False)
+            self.evictions += 1
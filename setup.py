@@ -43,6 +43,12 @@ class ve_build_ext(build_ext):
             raise BuildFailed()
 
 
+install_requires = ["pycrypto"]
+if sys.version_info[0] == 2:
+    # concurrent.futures is only in the standard library from 3.2
+    install_requires.append("futures")
+
+
 def run_setup(with_binary):
     cmdclass = {'test': Command}
     kw = {'cmdclass': cmdclass}
@@ -65,9 +71,7 @@ def run_setup(with_binary):
         long_description=open('README.rst').read(),
         author="PolyPasswordHasher Devs",
         author_email="polypasswordhasher-dev@googlegroups.com",
-        install_requires=[
-            "pycrypto"
-        ],
+        install_requires=install_requires,
         classifiers=['Development Status :: 3 - Alpha',
                      'Intended Audience :: Developers',
                      'Intended Audience :: Science/Research',